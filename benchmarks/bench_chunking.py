@@ -0,0 +1,137 @@
+"""
+Chunk counts, token sizes and embedding cost of the chunking strategies.
+
+Pages are extracted the way get_web_content does (extractors.extract_text)
+and split with each configuration. The report (JSON on stdout, optionally
+--output) has per configuration: chunks, tokens sent to the embedding model
+(redundancy = tokens embedded / page tokens, the cost of overlap), tokens
+per chunk (p50/p95/max), chunks over --model-limit (silently truncated by
+the model) and split time. With --ollama every chunk is also embedded with
+the configured Ollama model and the embedding time reported.
+
+Token counts use chunking.count_tokens, i.e. CHUNK_TOKENIZER; set it to
+mixedbread-ai/mxbai-embed-large-v1 (with tokenizers installed) for exact
+counts.
+
+Usage:
+    python benchmarks/bench_chunking.py --pages-count 200
+    python benchmarks/bench_chunking.py --corpus pages/ --ollama --output report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "cache latency vector index search query page corpus model token network server client stream "
+    "embedding retrieval document chunk parser thread process memory budget socket python async "
+    "benchmark throughput cluster storage database protocol signal kernel graph sample configuration "
+    "implementation distributed"
+).split()
+
+def synthetic_page(index: int) -> str:
+    """Article with headed sections, paragraphs of varied length and the odd list."""
+    rng = random.Random(index)
+
+    def sentence() -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))).capitalize() + "."
+
+    parts = [f"<h1>Article {index}</h1>"]
+    for section in range(rng.randint(2, 8)):
+        parts.append(f"<h2>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()}</h2>")
+        for _ in range(rng.randint(1, 6)):
+            parts.append("<p>" + " ".join(sentence() for _ in range(int(rng.lognormvariate(1.3, 0.8)) + 1)) + "</p>")
+        if rng.random() < 0.3:
+            parts.append("<ul>" + "".join(f"<li>{sentence()}</li>" for _ in range(rng.randint(3, 8))) + "</ul>")
+    return f"<html><body><article>{''.join(parts)}</article></body></html>"
+
+def load_pages(args: argparse.Namespace) -> List[str]:
+    if not args.corpus:
+        return [synthetic_page(index) for index in range(args.pages_count)]
+    pages = []
+    for name in sorted(os.listdir(args.corpus)):
+        if name.endswith(".html"):
+            with open(os.path.join(args.corpus, name), encoding="utf-8", errors="replace") as f:
+                pages.append(f.read())
+    return pages
+
+def percentile(values: List[int], q: float) -> int:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0
+
+async def embed_seconds(chunks: List[str], batch_size: int) -> float:
+    """Wall time to embed the chunks with the uncached Ollama model."""
+    from embeddings import create_ollama_client
+
+    model = create_ollama_client()
+    start = time.perf_counter()
+    for offset in range(0, len(chunks), batch_size):
+        await model.aembed_documents(chunks[offset:offset + batch_size])
+    return time.perf_counter() - start
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import chunking
+    import extractors
+
+    texts = [text for text in (extractors.extract_text(page) for page in load_pages(args)) if text]
+    page_tokens = sum(chunking.count_tokens(text) for text in texts)
+    configs = {
+        "chars 2000/200 (previous)": chunking.ChunkingConfig(strategy="chars", chunk_size=2000, chunk_overlap=200),
+        **{
+            f"tokens {max_tokens}": chunking.ChunkingConfig(strategy="tokens", max_tokens=max_tokens)
+            for max_tokens in args.max_tokens
+        },
+    }
+
+    results = []
+    for name, config in configs.items():
+        start = time.perf_counter()
+        chunks = [chunk for text in texts for chunk in chunking.split_text(text, config)]
+        split_seconds = time.perf_counter() - start
+        sizes = [chunking.count_tokens(chunk) for chunk in chunks]
+        result = {
+            "config": name,
+            "chunks": len(chunks),
+            "chunks_per_page": round(len(chunks) / len(texts), 2),
+            "tokens_embedded": sum(sizes),
+            "redundancy": round(sum(sizes) / page_tokens, 3),
+            "tokens_p50": percentile(sizes, 50),
+            "tokens_p95": percentile(sizes, 95),
+            "tokens_max": max(sizes, default=0),
+            "over_model_limit": sum(size > args.model_limit for size in sizes),
+            "split_ms_per_page": round(split_seconds * 1000 / len(texts), 3),
+        }
+        if args.ollama:
+            result["embed_s"] = round(asyncio.run(embed_seconds(chunks, args.batch_size)), 2)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return {"pages": len(texts), "page_tokens": page_tokens, "results": results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of saved .html pages (bench_extractors.py --save-urls)")
+    parser.add_argument("--pages-count", type=int, default=200, help="Synthetic pages without --corpus")
+    parser.add_argument("--max-tokens", type=lambda value: [int(item) for item in value.split(",")], default=[256, 400])
+    parser.add_argument("--model-limit", type=int, default=512, help="Embedding model context in tokens")
+    parser.add_argument("--ollama", action="store_true", help="Also time embedding every chunk with Ollama")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per Ollama embed request")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark the HTML extraction backends on a saved corpus of real pages.
+
+The corpus is a directory of .html files. A page may have a hand-checked
+main-content reference next to it (same name, .txt extension); quality is
+then reported as token precision/recall/F1 against it. Without references,
+recall is measured against the BeautifulSoup output (how much of the full
+page text a backend keeps).
+
+Usage:
+    python benchmarks/bench_extractors.py --save-urls urls.txt --corpus pages/
+    python benchmarks/bench_extractors.py --corpus pages/ --repeat 3
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractors
+
+def tokens(text: str) -> Counter:
+    return Counter(re.findall(r"\w+", text.lower()))
+
+def overlap(predicted: Counter, reference: Counter) -> Dict[str, float]:
+    common = sum((predicted & reference).values())
+    precision = common / (sum(predicted.values()) or 1)
+    recall = common / (sum(reference.values()) or 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+async def save_pages(urls: List[str], corpus: str) -> None:
+    """Download pages into the corpus directory so later runs are offline."""
+    import aiohttp
+    os.makedirs(corpus, exist_ok=True)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async def save(url: str) -> None:
+            try:
+                async with session.get(url, headers={"User-Agent": "Mozilla/5.0"}) as response:
+                    html = await response.text(errors="replace")
+            except Exception as e:
+                print(f"skip {url}: {e}", file=sys.stderr)
+                return
+            name = hashlib.sha1(url.encode()).hexdigest()[:16]
+            with open(os.path.join(corpus, f"{name}.html"), "w", encoding="utf-8") as f:
+                f.write(html)
+        await asyncio.gather(*(save(url) for url in urls))
+
+def load_corpus(corpus: str) -> List[Dict[str, Optional[str]]]:
+    pages = []
+    for name in sorted(os.listdir(corpus)):
+        if not name.endswith(".html"):
+            continue
+        with open(os.path.join(corpus, name), encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        reference_path = os.path.join(corpus, name[:-5] + ".txt")
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding="utf-8") as f:
+                reference = f.read()
+        pages.append({"name": name, "html": html, "reference": reference})
+    return pages
+
+def bench_backend(extractor: extractors.Extractor, pages, baseline: Dict[str, str], repeat: int) -> Dict:
+    outputs: Dict[str, str] = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            outputs[page["name"]] = extractor.extract(page["html"])
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(len(page["html"].encode("utf-8")) for page in pages) * repeat
+
+    scored = [
+        overlap(tokens(outputs[page["name"]]), tokens(page["reference"]))
+        for page in pages if page["reference"] is not None
+    ]
+    kept = [
+        overlap(tokens(outputs[page["name"]]), tokens(baseline[page["name"]]))["recall"]
+        for page in pages
+    ]
+    result = {
+        "pages_per_sec": len(pages) * repeat / elapsed if elapsed else 0.0,
+        "mb_per_sec": total_bytes / elapsed / 1e6 if elapsed else 0.0,
+        "avg_chars": sum(len(text) for text in outputs.values()) / (len(outputs) or 1),
+        "recall_vs_bs4": sum(kept) / (len(kept) or 1),
+    }
+    if scored:
+        result.update({
+            "reference_pages": len(scored),
+            "precision": sum(s["precision"] for s in scored) / len(scored),
+            "recall": sum(s["recall"] for s in scored) / len(scored),
+            "f1": sum(s["f1"] for s in scored) / len(scored),
+        })
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="Directory of saved .html pages")
+    parser.add_argument("--save-urls", help="File with one URL per line to download into the corpus first")
+    parser.add_argument("--backends", default=",".join(extractors.EXTRACTORS), help="Comma separated backends")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus per backend")
+    args = parser.parse_args()
+
+    if args.save_urls:
+        with open(args.save_urls) as f:
+            asyncio.run(save_pages([line.strip() for line in f if line.strip()], args.corpus))
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit(f"No .html pages found in {args.corpus}")
+    bs4 = extractors.BeautifulSoupExtractor()
+    baseline = {page["name"]: bs4.extract(page["html"]) for page in pages}
+
+    report = {"pages": len(pages), "backends": {}}
+    for name in args.backends.split(","):
+        try:
+            extractor = extractors.EXTRACTORS[name]()
+        except (KeyError, ImportError) as e:
+            report["backends"][name] = {"error": f"unavailable: {e}"}
+            continue
+        report["backends"][name] = bench_backend(extractor, pages, baseline, args.repeat)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
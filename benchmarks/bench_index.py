@@ -0,0 +1,126 @@
+"""
+Recall vs latency benchmark of the FAISS index backends in vector_index.py.
+
+Each backend is built with vector_index.build (training on a sample where
+needed) over the same vectors, then queried one vector at a time for every
+search parameter value (nprobe for IVF, efSearch for HNSW). Recall@k is
+measured against exact flat search. The report (JSON on stdout, optionally
+--output) has build time, index bytes per vector, recall and p50/p95 query
+latency per configuration.
+
+Vectors are synthetic clustered data by default; pass --vectors with a .npy
+array of real embeddings (e.g. dumped from a corpus index) for numbers that
+reflect mxbai-embed-large.
+
+Usage:
+    python benchmarks/bench_index.py --size 50000 --dim 1024
+    python benchmarks/bench_index.py --vectors embeddings.npy --backends ivf_sq8,hnsw_sq8 --output report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def clustered_vectors(count: int, dim: int, clusters: int, seed: int):
+    """Gaussian clusters with varying spread, closer to real embeddings than uniform noise."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    spread = rng.uniform(0.3, 1.0, size=clusters).astype(np.float32)
+    labels = rng.integers(clusters, size=count)
+    return centers[labels] + rng.normal(size=(count, dim)).astype(np.float32) * spread[labels, None]
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import faiss
+    import numpy as np
+    import vector_index
+
+    if args.vectors:
+        data = np.load(args.vectors).astype(np.float32)
+        rng = np.random.default_rng(args.seed)
+        rng.shuffle(data)
+        vectors, queries = data[args.queries:], data[:args.queries]
+    else:
+        data = clustered_vectors(args.size + args.queries, args.dim, args.clusters, args.seed)
+        vectors, queries = data[:args.size], data[args.size:]
+    dim = vectors.shape[1]
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for backend in args.backends.split(","):
+        start = time.perf_counter()
+        index = vector_index.build(vectors, backend)
+        build_seconds = time.perf_counter() - start
+        if vector_index.is_staging(index, backend):
+            print(f"Skipping {backend}: needs at least FAISS_TRAIN_SIZE={vector_index.FAISS_TRAIN_SIZE} vectors", file=sys.stderr)
+            continue
+        bytes_per_vector = len(faiss.serialize_index(index)) / len(vectors)
+        if hasattr(index, "hnsw"):
+            params = [("efSearch", value) for value in args.ef_search]
+        elif "IVF" in vector_index.factory_string(backend, dim):
+            params = [("nprobe", value) for value in args.nprobe]
+        else:
+            params = [(None, None)]
+        for name, value in params:
+            vector_index.tune(index, nprobe=value if name == "nprobe" else None, ef_search=value if name == "efSearch" else None)
+            latencies = []
+            found = []
+            for query in queries:
+                query_start = time.perf_counter()
+                _, ids = index.search(query[None, :], args.k)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+                found.append(ids[0])
+            recall = float(np.mean([len(set(row) & set(expected)) / args.k for row, expected in zip(found, truth)]))
+            result = {
+                "backend": backend,
+                "factory": vector_index.factory_string(backend, dim),
+                "build_s": round(build_seconds, 2),
+                "bytes_per_vector": round(bytes_per_vector, 1),
+                f"recall@{args.k}": round(recall, 4),
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+            }
+            if name:
+                result[name] = value
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return {"vectors": len(vectors), "dim": dim, "queries": len(queries), "results": results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50000, help="Synthetic vectors to index")
+    parser.add_argument("--dim", type=int, default=1024, help="Synthetic vector dimension (mxbai-embed-large: 1024)")
+    parser.add_argument("--clusters", type=int, default=200, help="Synthetic clusters")
+    parser.add_argument("--vectors", help=".npy array of real embeddings instead of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Query vectors held out of the index")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query for recall@k")
+    parser.add_argument("--backends", default=",".join(["flat", "fp16", "sq8", "ivf", "ivf_sq8", "ivfpq", "hnsw", "hnsw_sq8"]))
+    parser.add_argument("--nprobe", type=lambda value: [int(item) for item in value.split(",")], default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=lambda value: [int(item) for item in value.split(",")], default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
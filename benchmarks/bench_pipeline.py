@@ -0,0 +1,349 @@
+"""
+Offline end-to-end benchmark of mcp_server.search_and_analyze.
+
+Live services are replaced with local stand-ins:
+- a fake Exa client returning recorded (or synthetic) search results,
+- a fixture HTTP server serving saved (or synthetic) pages with lognormal
+  latency and size distributions,
+- a deterministic fake embedding server speaking the Ollama embed API.
+
+The stand-in servers run in a separate process so they do not compete with
+the pipeline for the event loop. Queries run at a fixed concurrency and the
+report (JSON on stdout, optionally --output) has p50/p95/p99 latency per
+stage, throughput and peak RSS.
+
+Recorded results are a JSON object mapping each query to a list of
+{"url", "title", "summary", "published_date"} results; pages are looked up
+in --pages by the file names bench_extractors.py --save-urls writes
+(sha1(url)[:16].html). Without them, queries and pages are synthetic.
+
+Usage:
+    python benchmarks/bench_pipeline.py --queries 50 --concurrency 8
+    python benchmarks/bench_pipeline.py --exa-results recorded.json --pages pages/ --output report.json
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "cache latency vector index search query page corpus model token network server client stream "
+    "embedding retrieval document chunk parser thread process memory budget socket python async "
+    "benchmark throughput cluster storage database protocol signal kernel graph sample"
+).split()
+
+def page_name(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()[:16]
+
+def lognormal(rng: random.Random, median: float, sigma: float) -> float:
+    return median * math.exp(rng.gauss(0, sigma)) if sigma > 0 else median
+
+def synthetic_page(index: int, size: int) -> str:
+    """Deterministic article-like page of roughly size bytes."""
+    rng = random.Random(index)
+    paragraphs = []
+    total = 0
+    while total < size:
+        paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 90))).capitalize() + "."
+        paragraphs.append(f"<p>{paragraph}</p>")
+        total += len(paragraph) + 7
+    nav = "".join(f'<a href="/page/{rng.randint(0, 999)}">{rng.choice(WORDS)}</a>' for _ in range(20))
+    return (
+        f"<!DOCTYPE html><html><head><title>Page {index}</title></head><body>"
+        f"<nav>{nav}</nav><article><h1>Page {index}</h1>{''.join(paragraphs)}</article>"
+        f"<footer>Footer {index}</footer></body></html>"
+    )
+
+def fake_vector(text: str, dim: int) -> List[float]:
+    """Hashed bag-of-words vector, so texts sharing words land close together."""
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode()).digest()
+        slot = int.from_bytes(digest[:4], "little") % dim
+        vector[slot] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def serve_fixtures(args: argparse.Namespace, web_port: int, embed_port: int, ready) -> None:
+    """Run the fixture page server and the fake Ollama server (in a child process)."""
+    from aiohttp import web
+
+    pages: Dict[str, bytes] = {}
+    if args.pages:
+        for name in os.listdir(args.pages):
+            if name.endswith(".html"):
+                with open(os.path.join(args.pages, name), "rb") as f:
+                    pages[name[:-5]] = f.read()
+    rng = random.Random(args.seed)
+
+    async def page(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        await asyncio.sleep(lognormal(rng, args.latency_ms, args.latency_sigma) / 1000)
+        if name not in pages:
+            if not name.isdigit():
+                raise web.HTTPNotFound()
+            size = int(lognormal(random.Random(int(name)), args.page_kb * 1024, args.page_sigma))
+            pages[name] = synthetic_page(int(name), size).encode()
+        return web.Response(body=pages[name], content_type="text/html", charset="utf-8")
+
+    async def embed(request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        await asyncio.sleep((args.embed_ms + args.embed_ms_per_text * len(texts)) / 1000)
+        return web.json_response({
+            "model": body.get("model"),
+            "embeddings": [fake_vector(text, args.embed_dim) for text in texts],
+        })
+
+    async def embeddings(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep((args.embed_ms + args.embed_ms_per_text) / 1000)
+        return web.json_response({"embedding": fake_vector(body.get("prompt", ""), args.embed_dim)})
+
+    async def main() -> None:
+        web_app = web.Application()
+        web_app.router.add_get("/page/{name}", page)
+        embed_app = web.Application(client_max_size=64 * 1024 * 1024)
+        embed_app.router.add_post("/api/embed", embed)
+        embed_app.router.add_post("/api/embeddings", embeddings)
+        for app, port in ((web_app, web_port), (embed_app, embed_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+class FakeExa:
+    """Stand-in for exa_py.Exa.search_and_contents with recorded or synthetic results."""
+
+    def __init__(self, base_url: str, recorded: Optional[Dict[str, List[Dict[str, Any]]]], page_pool: int, latency_ms: float):
+        self.base_url = base_url
+        self.recorded = recorded
+        self.page_pool = page_pool
+        self.latency_ms = latency_ms
+
+    def search_and_contents(self, query: str, num_results: int = 10, **kwargs: Any) -> SimpleNamespace:
+        time.sleep(self.latency_ms / 1000)
+        if self.recorded is not None:
+            items = self.recorded.get(query, [])[:num_results]
+            results = [
+                SimpleNamespace(
+                    url=f"{self.base_url}/page/{page_name(item['url'])}",
+                    title=item.get("title"),
+                    summary=item.get("summary", ""),
+                    published_date=item.get("published_date"),
+                )
+                for item in items
+            ]
+        else:
+            rng = random.Random(query)
+            results = [
+                SimpleNamespace(
+                    url=f"{self.base_url}/page/{index}",
+                    title=f"Page {index}",
+                    summary=" ".join(rng.choice(WORDS) for _ in range(20)),
+                    published_date=None,
+                )
+                for index in rng.sample(range(self.page_pool), min(num_results, self.page_pool))
+            ]
+        return SimpleNamespace(results=results)
+
+class TimedEmbeddings:
+    """Wraps the model client under the batcher so each embed request is timed."""
+
+    def __init__(self, underlying: Any, samples: Dict[str, List[float]]):
+        self.underlying = underlying
+        self.samples = samples
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        try:
+            return await self.underlying.aembed_documents(texts)
+        finally:
+            self.samples["embed_request"].append(time.perf_counter() - start)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+def timed(samples: Dict[str, List[float]], stage: str, func):
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            samples[stage].append(time.perf_counter() - start)
+    return wrapper
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))] * 1000
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_benchmark(args: argparse.Namespace, web_port: int) -> Dict[str, Any]:
+    import executors
+    import mcp_server
+    import rag
+    import search
+    from embeddings import get_embeddings
+
+    recorded = None
+    if args.exa_results:
+        with open(args.exa_results) as f:
+            recorded = json.load(f)
+    search.exa = FakeExa(f"http://127.0.0.1:{web_port}", recorded, args.page_pool, args.exa_ms)
+
+    # Per-stage timers around the module functions the pipeline calls
+    samples: Dict[str, List[float]] = defaultdict(list)
+    search.search_web = timed(samples, "search", search.search_web)
+    search.get_web_content = timed(samples, "fetch_page", search.get_web_content)
+    rag.split_documents_async = timed(samples, "split_page", rag.split_documents_async)
+    rag.update_corpus = timed(samples, "index", rag.update_corpus)
+    rag.search_rag = timed(samples, "retrieve", rag.search_rag)
+    stage_run = executors.process_stage.run
+
+    async def timed_stage_run(func, payload, *stage_args):
+        start = time.perf_counter()
+        try:
+            return await stage_run(func, payload, *stage_args)
+        finally:
+            samples[f"cpu:{func.__name__}"].append(time.perf_counter() - start)
+    executors.process_stage.run = timed_stage_run
+    batcher = getattr(get_embeddings(), "underlying", get_embeddings())
+    batcher.underlying = TimedEmbeddings(batcher.underlying, samples)
+
+    total = args.warmup + args.queries
+    if recorded is not None:
+        queries = list(recorded)
+        queries = [queries[i % len(queries)] for i in range(total)]
+    else:
+        rng = random.Random(args.seed)
+        queries = [f"{' '.join(rng.sample(WORDS, 4))} {i}" for i in range(total)]
+
+    slots = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def run_query(query: str) -> None:
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            response = await mcp_server.search_and_analyze(query, num_results=args.num_results, rag_results=args.rag_results)
+            samples["total"].append(time.perf_counter() - start)
+            if "error" in response:
+                errors += 1
+
+    for query in queries[:args.warmup]:
+        await run_query(query)
+    samples.clear()
+    errors = 0
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_query(query) for query in queries[args.warmup:]))
+    wall = time.perf_counter() - start
+    await search.close_session()
+    executors.process_stage.shutdown(wait=True)
+
+    measured = args.queries
+    return {
+        "queries": measured,
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_qps": measured / wall if wall else 0.0,
+        "pages_per_sec": len(samples["fetch_page"]) / wall if wall else 0.0,
+        "stages": {stage: summarize(values) for stage, values in sorted(samples.items()) if values},
+        # Linux reports kilobytes; pool workers are counted once they have exited
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20, help="Measured queries (after warmup)")
+    parser.add_argument("--warmup", type=int, default=0, help="Queries run before measuring")
+    parser.add_argument("--concurrency", type=int, default=4, help="Queries in flight at once")
+    parser.add_argument("--num-results", type=int, default=5, help="Search results per query")
+    parser.add_argument("--rag-results", type=int, default=3, help="RAG results per query")
+    parser.add_argument("--exa-results", help="JSON file of recorded Exa results per query")
+    parser.add_argument("--pages", help="Directory of saved .html pages served by the fixture server")
+    parser.add_argument("--page-pool", type=int, default=200, help="Synthetic pages that queries draw from")
+    parser.add_argument("--page-kb", type=float, default=60, help="Median synthetic page size in KB")
+    parser.add_argument("--page-sigma", type=float, default=0.8, help="Lognormal sigma of page sizes")
+    parser.add_argument("--latency-ms", type=float, default=80, help="Median page response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="Lognormal sigma of page latency")
+    parser.add_argument("--exa-ms", type=float, default=300, help="Fake Exa call latency")
+    parser.add_argument("--embed-ms", type=float, default=20, help="Fixed latency per embed request")
+    parser.add_argument("--embed-ms-per-text", type=float, default=2, help="Extra latency per embedded text")
+    parser.add_argument("--embed-dim", type=int, default=1024, help="Fake embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-caches", action="store_true", help="Use the configured CACHE_DIR instead of a fresh one")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.queries < 1 or args.concurrency < 1:
+        sys.exit("--queries and --concurrency must be positive")
+
+    web_port, embed_port = free_port(), free_port()
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    fixtures = context.Process(target=serve_fixtures, args=(args, web_port, embed_port, ready), daemon=True)
+    fixtures.start()
+    if not ready.wait(30):
+        sys.exit("Fixture servers did not start")
+
+    # Settings are read at import time, so they must be in place before the pipeline is imported
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{embed_port}"
+        os.environ.setdefault("EXA_API_KEY", "offline-benchmark")
+        if not args.keep_caches:
+            os.environ["CACHE_DIR"] = cache_dir
+            for name in ("EMBEDDING_CACHE_DIR", "CORPUS_DIR"):
+                os.environ.pop(name, None)
+        try:
+            report = asyncio.run(run_benchmark(args, web_port))
+        finally:
+            fixtures.terminate()
+            fixtures.join()
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
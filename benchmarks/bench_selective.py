@@ -0,0 +1,201 @@
+"""
+Embedding calls saved vs retrieval recall lost by selective embedding.
+
+For every query a set of pages is indexed twice: once fully embedded (the
+baseline) and once lexical-only followed by VectorCorpus.embed_selected with
+each --top-n / --explore setting. Recall@k is the overlap of the selective
+dense top-k with the baseline dense top-k; the embedded share is the chunks
+embedded over all chunks of the request's pages.
+
+Pages and embeddings are synthetic so the run is offline and repeatable:
+chunks are drawn from topic vocabularies and the stand-in embedding maps
+every word of a topic near a shared topic direction. Dense retrieval can
+therefore find chunks of the query's topic that share no word with the
+query, which BM25 pre-scoring misses; that gap is what exploration and a
+larger top-n pay for. Pass --ollama to embed with the configured Ollama
+model instead (chunks stay synthetic).
+
+Usage:
+    python benchmarks/bench_selective.py --queries 50 --pages-per-query 10
+    python benchmarks/bench_selective.py --top-n 5,10,20 --explore 0,4,8 --output report.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, List
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COMMON_WORDS = "the a of and to in is for on with that as by this from at are be it or".split()
+
+def topic_words(topic: int, size: int) -> List[str]:
+    return [f"t{topic}w{index}" for index in range(size)]
+
+def synthetic_chunks(page: int, args: argparse.Namespace) -> List[str]:
+    """Chunks mostly about the page's main topic, with some off-topic ones."""
+    rng = random.Random(page)
+    main_topic = page % args.topics
+    chunks = []
+    for _ in range(args.chunks_per_page):
+        topic = main_topic if rng.random() < 0.6 else rng.randrange(args.topics)
+        vocabulary = topic_words(topic, args.topic_words)
+        words = [
+            rng.choice(vocabulary) if rng.random() < 0.7 else rng.choice(COMMON_WORDS)
+            for _ in range(args.chunk_words)
+        ]
+        chunks.append(" ".join(words))
+    return chunks
+
+class TopicEmbeddings(Embeddings):
+    """Deterministic stand-in: a word's vector is its topic direction plus word-specific noise."""
+
+    def __init__(self, dim: int = 128):
+        import numpy as np
+
+        self.dim = dim
+        self.np = np
+        self.texts = 0
+        self._cache: Dict[str, Any] = {}
+
+    def _direction(self, key: str):
+        if key not in self._cache:
+            seed = int.from_bytes(hashlib.sha1(key.encode()).digest()[:4], "big")
+            vector = self.np.random.default_rng(seed).normal(size=self.dim)
+            self._cache[key] = vector / self.np.linalg.norm(vector)
+        return self._cache[key]
+
+    def _embed(self, text: str) -> List[float]:
+        total = self.np.zeros(self.dim)
+        for word in text.split():
+            if word.startswith("t") and "w" in word:
+                total += self._direction(word.split("w")[0]) + 0.5 * self._direction(word)
+            else:
+                total += 0.2 * self._direction(word)
+        return (total / (self.np.linalg.norm(total) or 1.0)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+class CountingEmbeddings(Embeddings):
+    """Counts texts embedded by a real embeddings object."""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts += len(texts)
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts += len(texts)
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    from langchain_core.documents import Document
+    import rag
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    if args.ollama:
+        from embeddings import get_embeddings
+        make_embeddings = lambda: CountingEmbeddings(get_embeddings())
+    else:
+        make_embeddings = lambda: TopicEmbeddings(args.dim)
+
+    configs = [(top_n, explore) for top_n in args.top_n for explore in args.explore]
+    totals = {config: {"embedded": 0, "recall": 0.0} for config in configs}
+    total_chunks = 0
+    for _ in range(args.queries):
+        topic = rng.randrange(args.topics)
+        query = " ".join(rng.sample(topic_words(topic, args.topic_words), args.query_words))
+        # A few pages on the query's topic among unrelated ones, like a web search result page
+        on_topic = [topic + args.topics * rng.randrange(100) for _ in range(args.on_topic_pages)]
+        pages = on_topic + [rng.randrange(args.topics * 100) for _ in range(args.pages_per_query - len(on_topic))]
+        sources = [f"https://bench.local/page/{page}" for page in pages]
+        documents = [
+            Document(page_content=text, metadata={"source": source})
+            for page, source in zip(pages, sources)
+            for text in synthetic_chunks(page, args)
+        ]
+        total_chunks += len(documents)
+
+        baseline = rag.VectorCorpus(embeddings=make_embeddings())
+        await baseline.add_documents(documents)
+        expected = {document.page_content for document in await baseline.search(query, k=args.k, sources=sources)}
+
+        for top_n, explore in configs:
+            embeddings = make_embeddings()
+            corpus = rag.VectorCorpus(embeddings=embeddings)
+            await corpus.add_documents(documents, embed=False)
+            await corpus.embed_selected(query, sources, top_n=top_n, explore=explore)
+            found = {document.page_content for document in await corpus.search(query, k=args.k, sources=sources)}
+            totals[(top_n, explore)]["embedded"] += embeddings.texts
+            totals[(top_n, explore)]["recall"] += len(found & expected) / max(len(expected), 1)
+
+    results = []
+    for (top_n, explore), total in totals.items():
+        result = {
+            "top_n": top_n,
+            "explore": explore,
+            "embedded_share": round(total["embedded"] / total_chunks, 3),
+            "embedding_calls_saved": round(1 - total["embedded"] / total_chunks, 3),
+            f"recall@{args.k}": round(total["recall"] / args.queries, 3),
+        }
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return {"queries": args.queries, "chunks_per_query": total_chunks / args.queries, "results": results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--pages-per-query", type=int, default=10)
+    parser.add_argument("--on-topic-pages", type=int, default=3, help="Pages per query whose main topic is the query's")
+    parser.add_argument("--chunks-per-page", type=int, default=12)
+    parser.add_argument("--chunk-words", type=int, default=120)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--topic-words", type=int, default=200, help="Vocabulary size per topic")
+    parser.add_argument("--query-words", type=int, default=3)
+    parser.add_argument("--k", type=int, default=5, help="Results per query (rag_results)")
+    parser.add_argument("--top-n", type=lambda value: [int(item) for item in value.split(",")], default=[5, 10, 20, 40])
+    parser.add_argument("--explore", type=lambda value: [int(item) for item in value.split(",")], default=[0, 4])
+    parser.add_argument("--dim", type=int, default=128, help="Stand-in embedding dimension")
+    parser.add_argument("--ollama", action="store_true", help="Embed with the configured Ollama model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.on_topic_pages > args.pages_per_query:
+        sys.exit("--on-topic-pages cannot exceed --pages-per-query")
+
+    report = asyncio.run(run_benchmark(args))
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "900"))  # seconds
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Seconds to wait for another process (server worker) holding the SQLite write lock
+PAGE_CACHE_BUSY_TIMEOUT = float(os.getenv("PAGE_CACHE_BUSY_TIMEOUT", "30"))
+# Hits refresh an entry's LRU timestamp only when it is older than this, so reads stay reads
+PAGE_CACHE_TOUCH_INTERVAL = float(os.getenv("PAGE_CACHE_TOUCH_INTERVAL", "60"))  # seconds
+COMPRESSION_LEVEL = 6
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))  # seconds
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.92"))
+
+# Query parameters that never change page content
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref_src")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so equivalent links share one cache entry."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    ))
+    # Fragments are never sent to the server
+    return urlunsplit((scheme, host, path, query, ""))
+
+@dataclass
+class CachedPage:
+    """Extracted page text with the validators needed to revalidate it."""
+    url: str
+    content: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    def is_fresh(self, ttl: float = PAGE_CACHE_TTL) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+class PageCache:
+    """
+    Persistent store of extracted page text keyed by normalized URL.
+
+    Entries are zlib-compressed in a SQLite file and evicted least recently
+    used first once the compressed size exceeds the byte budget.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = PAGE_CACHE_TTL,
+        max_bytes: int = PAGE_CACHE_MAX_BYTES
+    ):
+        self.path = path or os.path.join(CACHE_DIR, "pages.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=PAGE_CACHE_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self._conn.commit()
+        logger.info(f"Page cache opened at {self.path} (ttl: {ttl}s, budget: {max_bytes} bytes)")
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Return the cached page for a URL, fresh or stale, and mark it as used."""
+        key = self._key(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, content, etag, last_modified, fetched_at, accessed_at FROM pages WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            # Eviction only needs a coarse recency; skipping most updates keeps hits off the write lock
+            if now - row[5] >= PAGE_CACHE_TOUCH_INTERVAL:
+                self._conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        cached_url, blob, etag, last_modified, fetched_at, _ = row
+        return CachedPage(
+            url=cached_url,
+            content=zlib.decompress(blob).decode("utf-8"),
+            etag=etag,
+            last_modified=last_modified,
+            fetched_at=fetched_at
+        )
+
+    def put(
+        self,
+        url: str,
+        content: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> None:
+        """Store extracted text for a URL and enforce the byte budget."""
+        blob = zlib.compress(content.encode("utf-8"), COMPRESSION_LEVEL)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(url), url, blob, len(blob), etag, last_modified, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+        logger.debug(f"Cached {len(content)} characters ({len(blob)} bytes compressed) for {url}")
+
+    def touch(self, url: str) -> None:
+        """Mark an entry as revalidated (e.g. after a 304 Not Modified)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, self._key(url))
+            )
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache fits its budget."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM pages ORDER BY accessed_at"):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM pages WHERE key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} pages from the page cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of entries and their compressed size."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_page_cache: Optional[PageCache] = None
+
+def get_page_cache() -> Optional[PageCache]:
+    """Return the shared page cache, or None when it is disabled."""
+    global _page_cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    if _page_cache is None:
+        _page_cache = PageCache()
+    return _page_cache
+
+def normalize_query(query: str) -> str:
+    """Lower-case a query and strip punctuation and extra whitespace."""
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+@dataclass
+class QueryLookup:
+    """Outcome of a query cache lookup."""
+    response: Optional[Dict[str, Any]]
+    match: Optional[str]  # "exact", "similar" or None
+    similarity: float
+    vector: Optional[np.ndarray]
+
+class QueryResultCache:
+    """
+    Bounded TTL cache of tool responses keyed by query.
+
+    A query matches an entry with the same parameters when its normalized
+    text is identical or when the cosine similarity of the query embeddings
+    reaches the threshold. Least recently used entries are dropped first.
+    """
+
+    def __init__(
+        self,
+        ttl: float = QUERY_CACHE_TTL,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        similarity_threshold: float = QUERY_CACHE_SIMILARITY
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, Hashable], Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _expire(self) -> None:
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry["expires_at"] <= now]:
+            del self._entries[key]
+
+    async def lookup(
+        self,
+        query: str,
+        params: Hashable,
+        embed_query: Optional[Callable[[str], Awaitable[List[float]]]]
+    ) -> QueryLookup:
+        """Find a cached response by exact normalized text, then by embedding similarity (if embed_query is given)."""
+        self._expire()
+        key = (normalize_query(query), params)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info(f"Query cache hit for '{query}'")
+            return QueryLookup(entry["response"], "exact", 1.0, entry["vector"])
+        if embed_query is None:
+            self.misses += 1
+            return QueryLookup(None, None, 0.0, None)
+        
+        try:
+            vector = np.asarray(await embed_query(query), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+        except Exception as e:
+            logger.warning(f"Query cache could not embed '{query}': {str(e)}")
+            self.misses += 1
+            return QueryLookup(None, None, 0.0, None)
+        
+        candidates = [
+            (candidate_key, entry) for candidate_key, entry in self._entries.items()
+            if candidate_key[1] == params and entry["vector"] is not None
+        ]
+        if candidates:
+            similarities = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                best_key, entry = candidates[best]
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                logger.info(f"Query cache near hit for '{query}' ~ '{best_key[0]}' ({similarities[best]:.3f})")
+                return QueryLookup(entry["response"], "similar", float(similarities[best]), vector)
+        self.misses += 1
+        return QueryLookup(None, None, 0.0, vector)
+
+    def put(self, query: str, params: Hashable, response: Dict[str, Any], vector: Optional[np.ndarray]) -> None:
+        """Store a response for a query and evict the least recently used entries."""
+        key = (normalize_query(query), params)
+        self._entries[key] = {
+            "response": response,
+            "vector": vector,
+            "expires_at": time.time() + self.ttl
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return entry count and hit, near-hit and miss counters."""
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.near_hits) / lookups if lookups else 0.0
+        }
+
+_query_cache: Optional[QueryResultCache] = None
+
+def get_query_cache() -> Optional[QueryResultCache]:
+    """Return the shared query result cache, or None when it is disabled."""
+    global _query_cache
+    if not QUERY_CACHE_ENABLED:
+        return None
+    if _query_cache is None:
+        _query_cache = QueryResultCache()
+    return _query_cache
+
+class TTLCache:
+    """Small in-memory cache whose entries expire after ttl seconds (LRU bounded)."""
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight call.
+
+    The first caller starts the work; later callers with the same key await
+    the same task until it finishes. The task is shielded so one caller
+    giving up does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is not None and not task.done():
+            self.shared += 1
+            logger.debug(f"Joining in-flight call for {key}")
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        return await asyncio.shield(task)
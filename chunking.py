@@ -0,0 +1,232 @@
+from dataclasses import asdict, dataclass, fields, replace
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import logging
+import os
+import re
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+CHUNKING_STRATEGIES = ("tokens", "chars")
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "tokens")
+# "chars" strategy: the original fixed-size character splitter
+CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "2000"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "200"))
+# "tokens" strategy: sizes in embedding model tokens (mxbai-embed-large reads 512)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "64"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))  # upper bound, see split_tokens
+# "estimate" or a Hugging Face tokenizer name, e.g. mixedbread-ai/mxbai-embed-large-v1 (needs tokenizers)
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "estimate")
+HEADING_MAX_CHARS = 100
+HEADING_MAX_WORDS = 12
+
+WORD_PIECES = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    """How page text is cut into chunks; can be overridden per request."""
+    strategy: str = CHUNK_STRATEGY
+    max_tokens: int = CHUNK_MAX_TOKENS
+    min_tokens: int = CHUNK_MIN_TOKENS
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+    chunk_size: int = CHUNK_SIZE
+    chunk_overlap: int = CHUNK_OVERLAP
+
+    def __post_init__(self):
+        if self.strategy not in CHUNKING_STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy '{self.strategy}', expected one of {', '.join(CHUNKING_STRATEGIES)}")
+        if self.max_tokens < 16 or self.chunk_size < 100:
+            raise ValueError("max_tokens must be at least 16 and chunk_size at least 100")
+        if not 0 <= self.min_tokens <= self.max_tokens or not 0 <= self.overlap_tokens < self.max_tokens:
+            raise ValueError("min_tokens and overlap_tokens must be between 0 and max_tokens")
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError("chunk_overlap must be between 0 and chunk_size")
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]] = None) -> "ChunkingConfig":
+        """Defaults overridden by a request's chunking options; raises ValueError on bad input."""
+        options = options or {}
+        known = {field.name for field in fields(cls)}
+        unknown = set(options) - known
+        if unknown:
+            raise ValueError(f"Unknown chunking options: {', '.join(sorted(unknown))}")
+        return replace(DEFAULT_CONFIG, **options)
+
+    def key(self) -> str:
+        """Short identifier of the settings that affect the chunks produced."""
+        if self.strategy == "chars":
+            return f"chars:{self.chunk_size}:{self.chunk_overlap}"
+        return f"tokens:{self.max_tokens}:{self.min_tokens}:{self.overlap_tokens}:{CHUNK_TOKENIZER}"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+DEFAULT_CONFIG = ChunkingConfig()
+
+def estimate_tokens(text: str) -> int:
+    """Approximate WordPiece token count: one per short word or symbol, more for long words."""
+    return sum(1 + max(len(piece) - 8, 0) // 4 for piece in WORD_PIECES.findall(text))
+
+_tokenizer: Optional[Callable[[str], int]] = None
+
+def count_tokens(text: str) -> int:
+    """Token count with CHUNK_TOKENIZER, falling back to estimate_tokens."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = estimate_tokens
+        if CHUNK_TOKENIZER != "estimate":
+            try:
+                from tokenizers import Tokenizer
+                tokenizer = Tokenizer.from_pretrained(CHUNK_TOKENIZER)
+                _tokenizer = lambda value: len(tokenizer.encode(value, add_special_tokens=False).ids)
+            except Exception as e:
+                logger.warning(f"Tokenizer '{CHUNK_TOKENIZER}' unavailable, estimating token counts: {str(e)}")
+    return _tokenizer(text)
+
+def _is_heading(line: str, next_line: Optional[str]) -> bool:
+    """Extracted pages keep one block per line; a heading is a short unpunctuated line before a paragraph."""
+    return (
+        next_line is not None
+        and len(line) <= HEADING_MAX_CHARS
+        and len(line.split()) <= HEADING_MAX_WORDS
+        and not line.endswith((".", "!", "?", ",", ";", ":"))
+        and len(next_line) > HEADING_MAX_CHARS
+    )
+
+def _sections(text: str) -> List[Tuple[Optional[str], List[str]]]:
+    """Group lines into (heading, blocks) sections."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    sections: List[Tuple[Optional[str], List[str]]] = [(None, [])]
+    for index, line in enumerate(lines):
+        if _is_heading(line, lines[index + 1] if index + 1 < len(lines) else None):
+            sections.append((line, []))
+        else:
+            sections[-1][1].append(line)
+    return [section for section in sections if section[0] or section[1]]
+
+def _units(block: str, max_tokens: int) -> List[Tuple[str, int, bool]]:
+    """Pieces of a block that fit max_tokens: (text, tokens, continues the previous piece's paragraph)."""
+    tokens = count_tokens(block)
+    if tokens <= max_tokens:
+        return [(block, tokens, False)]
+    units = []
+    for sentence in SENTENCE_END.split(block):
+        sentence_tokens = count_tokens(sentence)
+        if sentence_tokens <= max_tokens:
+            units.append((sentence, sentence_tokens, True))
+            continue
+        # A sentence longer than a chunk (tables, code, run-on text): cut it by words
+        window: List[str] = []
+        window_tokens = 0
+        for word in sentence.split():
+            word_tokens = count_tokens(word)
+            if window and window_tokens + word_tokens > max_tokens:
+                units.append((" ".join(window), window_tokens, True))
+                window, window_tokens = [], 0
+            window.append(word)
+            window_tokens += word_tokens
+        if window:
+            units.append((" ".join(window), window_tokens, True))
+    first_text, first_tokens, _ = units[0]
+    units[0] = (first_text, first_tokens, False)
+    return units
+
+def split_tokens(text: str, config: ChunkingConfig = DEFAULT_CONFIG) -> List[str]:
+    """
+    Split page text into chunks of at most max_tokens model tokens along its structure.
+
+    Sections start a new chunk once the current one has min_tokens; a
+    section too long for one chunk is cut between paragraphs, then between
+    sentences. Overlap adapts to the cut: none at a section boundary, the
+    section heading between paragraphs, and the heading plus trailing
+    sentences (up to overlap_tokens) inside a paragraph.
+    """
+    chunks: List[List[Tuple[str, int, bool]]] = []
+    current: List[Tuple[str, int, bool]] = []
+    current_tokens = 0
+
+    def flush() -> None:
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(current)
+        current, current_tokens = [], 0
+
+    for heading, blocks in _sections(text):
+        if current_tokens >= config.min_tokens:
+            flush()
+        heading_unit = None
+        if heading:
+            heading_unit = (heading, count_tokens(heading), False)
+            units = [heading_unit]
+        else:
+            units = []
+        for block in blocks:
+            units.extend(_units(block, config.max_tokens))
+        for unit in units:
+            if current and current_tokens + unit[1] > config.max_tokens:
+                previous = current
+                flush()
+                carried = []
+                if heading_unit and unit is not heading_unit:
+                    carried.append(heading_unit)
+                tail: List[Tuple[str, int, bool]] = []
+                if unit[2]:
+                    # Cut inside a paragraph: repeat its last sentences for context
+                    budget = config.overlap_tokens
+                    for previous_unit in reversed(previous):
+                        if previous_unit is heading_unit or previous_unit[1] > budget:
+                            break
+                        tail.insert(0, previous_unit)
+                        budget -= previous_unit[1]
+                        if not previous_unit[2]:
+                            break
+                    if tail:
+                        tail[0] = (tail[0][0], tail[0][1], False)
+                    carried.extend(tail)
+                # Carried context never pushes the new chunk past max_tokens
+                while carried and sum(item[1] for item in carried) + unit[1] > config.max_tokens:
+                    carried.pop()
+                if not carried or carried[-1] is heading_unit:
+                    # Nothing of its paragraph precedes the piece any more
+                    unit = (unit[0], unit[1], False)
+                current = carried
+                current_tokens = sum(item[1] for item in carried)
+            current.append(unit)
+            current_tokens += unit[1]
+    flush()
+
+    # Fold a small trailing chunk into the previous one when it fits
+    if len(chunks) > 1:
+        last_tokens = sum(unit[1] for unit in chunks[-1])
+        if last_tokens < config.min_tokens and sum(unit[1] for unit in chunks[-2]) + last_tokens <= config.max_tokens:
+            chunks[-2].extend(chunks.pop())
+
+    return [_join(chunk) for chunk in chunks]
+
+def _join(units: List[Tuple[str, int, bool]]) -> str:
+    parts = []
+    for index, (text, _, continues) in enumerate(units):
+        if index:
+            parts.append(" " if continues else "\n")
+        parts.append(text)
+    return "".join(parts)
+
+def split_text(text: str, config: Optional[ChunkingConfig] = None) -> List[str]:
+    """Split page text into chunks with the configured strategy"""
+    config = config or DEFAULT_CONFIG
+    if config.strategy == "tokens":
+        return split_tokens(text, config)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=config.chunk_size,
+        chunk_overlap=config.chunk_overlap,
+        length_function=len,
+    )
+    return text_splitter.split_text(text)
+
+def split_buffer(buffer: Union[bytes, memoryview], config: Optional[ChunkingConfig] = None) -> List[str]:
+    """Split UTF-8 encoded page text (process pool entry point)"""
+    return split_text(str(buffer, "utf-8"), config)
@@ -0,0 +1,253 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from langchain_core.documents import Document
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+import hashlib
+import logging
+import os
+import re
+import threading
+import numpy as np
+import lexical
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))  # differing bits out of 64
+SIMHASH_SHINGLE_SIZE = 3  # words per shingle
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+BOILERPLATE_MIN_RATIO = float(os.getenv("BOILERPLATE_MIN_RATIO", "0.5"))  # share of a domain's pages
+BOILERPLATE_MAX_DOMAINS = int(os.getenv("BOILERPLATE_MAX_DOMAINS", "1000"))
+BOILERPLATE_MAX_LINES = 50000  # tracked lines per domain
+
+dropped_total: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_dedup_dropped_total", "Near-duplicate chunks and boilerplate lines removed before embedding", ["kind"]
+))
+dropped_bytes_total: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_dedup_dropped_bytes_total", "Bytes of text removed before embedding", ["kind"]
+))
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word shingles."""
+    tokens = lexical.tokenize(text)
+    size = min(SIMHASH_SHINGLE_SIZE, len(tokens))
+    if size == 0:
+        return 0
+    shingles = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles),
+        dtype=">u8"
+    )
+    # One row of 64 bits per shingle; a bit is set when most shingles set it
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    majority = (bits.sum(axis=0) * 2 > len(shingles)).astype(np.uint8)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+@dataclass
+class DedupStats:
+    """What a deduplication pass removed."""
+    chunks_in: int = 0
+    duplicate_chunks: int = 0
+    duplicate_bytes: int = 0
+    boilerplate_lines: int = 0
+    boilerplate_bytes: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+class SimHashIndex:
+    """
+    Finds a key whose SimHash is within max_distance bits of a fingerprint.
+
+    Fingerprints are split into max_distance + 1 bands: two fingerprints
+    that differ in at most max_distance bits share at least one band
+    exactly, so only keys in matching band buckets are compared.
+    Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-64 // self.bands)
+        # band -> band value -> key -> fingerprint
+        self._buckets: List[Dict[int, Dict[Hashable, int]]] = [{} for _ in range(self.bands)]
+        self._fingerprints: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.bands)]
+
+    def find(self, fingerprint: int, accept: Optional[Callable[[Hashable], bool]] = None) -> Optional[Hashable]:
+        """Return a key within max_distance bits of fingerprint, if any (and accept(key))."""
+        for band, value in enumerate(self._band_keys(fingerprint)):
+            for key, other in self._buckets[band].get(value, {}).items():
+                if (accept is None or accept(key)) and bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, key: Hashable, fingerprint: int) -> None:
+        self.remove(key)
+        self._fingerprints[key] = fingerprint
+        for band, value in enumerate(self._band_keys(fingerprint)):
+            self._buckets[band].setdefault(value, {})[key] = fingerprint
+
+    def remove(self, key: Hashable) -> None:
+        fingerprint = self._fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for band, value in enumerate(self._band_keys(fingerprint)):
+            bucket = self._buckets[band][value]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[band][value]
+
+class NearDuplicateFilter:
+    """Drops chunks whose SimHash is within max_distance bits of a chunk seen before."""
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self._index = SimHashIndex(max_distance)
+        self._lock = threading.Lock()
+
+    def seen(self, fingerprint: int) -> bool:
+        """Return True for a near-duplicate, otherwise remember the fingerprint."""
+        with self._lock:
+            if self._index.find(fingerprint) is not None:
+                return True
+            self._index.add(len(self._index), fingerprint)
+        return False
+
+    def filter(self, chunks: List[Document], stats: DedupStats) -> List[Document]:
+        kept = []
+        for chunk in chunks:
+            stats.chunks_in += 1
+            if self.seen(simhash(chunk.page_content)):
+                stats.duplicate_chunks += 1
+                stats.duplicate_bytes += len(chunk.page_content.encode("utf-8"))
+                continue
+            kept.append(chunk)
+        return kept
+
+def drop_near_duplicates(chunks: List[Document], stats: DedupStats) -> List[Document]:
+    """
+    Drop chunks near-duplicating an earlier chunk of the same source.
+
+    Copies across pages are not dropped here but aliased by the corpus
+    (VectorCorpus.replace_source), so a search limited to the copy's source
+    still finds them.
+    """
+    filters: Dict[str, NearDuplicateFilter] = {}
+    kept = []
+    for chunk in chunks:
+        near_duplicates = filters.setdefault(chunk.metadata.get("source", ""), NearDuplicateFilter())
+        kept.extend(near_duplicates.filter([chunk], stats))
+    return kept
+
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\s+", " ", line.strip().lower())
+
+def _line_key(line: str) -> bytes:
+    return hashlib.blake2b(_normalize_line(line).encode("utf-8"), digest_size=8).digest()
+
+class BoilerplateDetector:
+    """
+    Learns lines repeated across many pages of the same domain (navigation,
+    footers, cookie banners) and strips them from page text.
+
+    A line is boilerplate once it appeared on at least min_pages distinct
+    pages of its domain and on at least min_ratio of the domain's pages
+    seen so far. Domains are kept in an LRU bounded by max_domains.
+    """
+
+    def __init__(
+        self,
+        min_pages: int = BOILERPLATE_MIN_PAGES,
+        min_ratio: float = BOILERPLATE_MIN_RATIO,
+        max_domains: int = BOILERPLATE_MAX_DOMAINS
+    ):
+        self.min_pages = min_pages
+        self.min_ratio = min_ratio
+        self.max_domains = max_domains
+        # domain -> (page URLs seen, line hash -> number of pages containing it)
+        self._domains: "OrderedDict[str, Tuple[Set[str], Dict[bytes, int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _domain(self, domain: str) -> Tuple[Set[str], Dict[bytes, int]]:
+        entry = self._domains.get(domain)
+        if entry is None:
+            entry = self._domains[domain] = (set(), {})
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        self._domains.move_to_end(domain)
+        return entry
+
+    def observe(self, url: str, text: str) -> None:
+        """Count the distinct lines of a page once per URL."""
+        domain = urlsplit(url).netloc.lower()
+        keys = {_line_key(line) for line in text.splitlines() if line.strip()}
+        with self._lock:
+            pages, lines = self._domain(domain)
+            if url in pages:
+                return
+            pages.add(url)
+            for key in keys:
+                lines[key] = lines.get(key, 0) + 1
+            if len(lines) > BOILERPLATE_MAX_LINES:
+                # Forget lines seen only once
+                for key in [key for key, count in lines.items() if count < 2]:
+                    del lines[key]
+
+    def strip(self, url: str, text: str, stats: DedupStats) -> str:
+        """Remove the boilerplate lines of the page's domain from text."""
+        domain = urlsplit(url).netloc.lower()
+        with self._lock:
+            entry = self._domains.get(domain)
+            if entry is None or len(entry[0]) < self.min_pages:
+                return text
+            pages, lines = entry
+            threshold = max(self.min_pages, self.min_ratio * len(pages))
+            kept = []
+            for line in text.splitlines():
+                if line.strip() and lines.get(_line_key(line), 0) >= threshold:
+                    stats.boilerplate_lines += 1
+                    stats.boilerplate_bytes += len(line.encode("utf-8")) + 1
+                    continue
+                kept.append(line)
+        return "\n".join(kept)
+
+_boilerplate = BoilerplateDetector()
+
+def strip_boilerplate(documents: List[Document], stats: DedupStats) -> List[Document]:
+    """Learn from and strip domain boilerplate lines in whole pages, before splitting."""
+    if not DEDUP_ENABLED:
+        return documents
+    cleaned = []
+    for document in documents:
+        source = document.metadata.get("source", "")
+        _boilerplate.observe(source, document.page_content)
+        text = _boilerplate.strip(source, document.page_content, stats)
+        if text.strip():
+            cleaned.append(Document(page_content=text, metadata=document.metadata))
+    return cleaned
+
+def record(stats: DedupStats) -> None:
+    """Export a pass's counts as metrics and log them."""
+    dropped_total.inc(stats.duplicate_chunks, kind="near_duplicate_chunk")
+    dropped_bytes_total.inc(stats.duplicate_bytes, kind="near_duplicate_chunk")
+    dropped_total.inc(stats.boilerplate_lines, kind="boilerplate_line")
+    dropped_bytes_total.inc(stats.boilerplate_bytes, kind="boilerplate_line")
+    metrics.count("dedup_duplicate_chunks", stats.duplicate_chunks)
+    metrics.count("dedup_duplicate_bytes", stats.duplicate_bytes)
+    metrics.count("dedup_boilerplate_lines", stats.boilerplate_lines)
+    metrics.count("dedup_boilerplate_bytes", stats.boilerplate_bytes)
+    if stats.duplicate_chunks or stats.boilerplate_lines:
+        logger.info(
+            f"Dedup dropped {stats.duplicate_chunks} of {stats.chunks_in} chunks ({stats.duplicate_bytes} bytes) "
+            f"and {stats.boilerplate_lines} boilerplate lines ({stats.boilerplate_bytes} bytes)"
+        )
@@ -0,0 +1,577 @@
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+import asyncio
+import hashlib
+import httpx
+import json
+import logging
+import math
+import os
+import re
+import threading
+import cache
+import executors
+import lexical
+import metrics
+import resilience
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is then safe for a single process only
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+EMBEDDING_PROVIDERS = ("ollama", "onnx", "hashing")
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "ollama")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "mxbai-embed-large:latest")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))  # seconds
+OLLAMA_KEEP_ALIVE = int(os.getenv("OLLAMA_KEEP_ALIVE", "1800"))  # seconds Ollama keeps the model loaded
+# In-process CPU backends
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "")  # directory with model.onnx and tokenizer.json
+EMBEDDING_ONNX_POOLING = os.getenv("EMBEDDING_ONNX_POOLING", "cls")  # cls (mxbai-embed-large) or mean
+EMBEDDING_ONNX_MAX_TOKENS = int(os.getenv("EMBEDDING_ONNX_MAX_TOKENS", "512"))
+EMBEDDING_ONNX_BATCH_SIZE = int(os.getenv("EMBEDDING_ONNX_BATCH_SIZE", "16"))
+EMBEDDING_HASH_DIM = int(os.getenv("EMBEDDING_HASH_DIM", "1024"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(cache.CACHE_DIR, "embeddings"))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "20000"))
+# Budget of the vector file per model; compaction keeps the most recently used rows
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+COMPACT_TARGET = 0.8  # share of the budget kept by a compaction
+COMPACT_BLOCK_ROWS = 4096
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "10"))
+EMBEDDING_MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES", "2"))
+
+def embedding_key(text: str, model: str) -> str:
+    """Hash a chunk together with the model that embeds it."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Two-tier vector cache for a single embedding model.
+
+    Recently used vectors live in an in-memory LRU. Every vector is also
+    appended to a float32 file that is read back through a memory map, with
+    an append-only index file mapping content hashes to rows. Once the file
+    exceeds max_bytes it is compacted to the most recently used rows.
+
+    Several processes (server workers) can share one cache directory: appends
+    and compactions hold an exclusive lock file, index reads a shared one, and
+    rows appended by other processes are picked up from the index file on a
+    miss. A compaction bumps the generation in meta.json so other processes
+    reload the rewritten files. The vector file is mapped read only, so its
+    pages are shared through the OS page cache.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        directory: str = EMBEDDING_CACHE_DIR,
+        memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES
+    ):
+        self.model = model
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "index.tsv")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._lock_path = os.path.join(self.directory, "lock")
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._rows: Dict[str, int] = {}
+        # Last use of each key seen by this process, for compaction
+        self._used: Dict[str, int] = {}
+        self._tick = 0
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._mmap: Optional[np.memmap] = None
+        self._index_offset = 0
+        self._load()
+
+    def _load(self) -> None:
+        with self._lock, self._file_lock(shared=True):
+            self._read_index()
+        if self._rows:
+            logger.info(f"Embedding cache loaded {len(self._rows)} vectors for {self.model}")
+
+    def _read_meta(self) -> None:
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self._dim = meta["dim"]
+        if meta.get("generation", 0) != self._generation:
+            # Compacted by another process: row numbers changed, read the index from the start
+            self._generation = meta.get("generation", 0)
+            self._rows = {}
+            self._index_offset = 0
+            self._mmap = None
+
+    def _read_index(self) -> None:
+        """Read index lines appended since the last call, ignoring partially written rows (file lock held)."""
+        if not os.path.exists(self._meta_path):
+            return
+        self._read_meta()
+        if not os.path.exists(self._index_path) or os.path.getsize(self._index_path) <= self._index_offset:
+            return
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # Rows are written before their index lines, so every complete line read has its vector
+        stored_rows = os.path.getsize(self._vectors_path) // (4 * self._dim) if os.path.exists(self._vectors_path) else 0
+        # A line still being written is read on a later call
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < stored_rows:
+                self._rows[parts[0]] = int(parts[1])
+        self._index_offset += end
+        self._remap()
+
+    def _remap(self) -> None:
+        if self._dim is None or not os.path.exists(self._vectors_path):
+            return
+        rows = os.path.getsize(self._vectors_path) // (4 * self._dim)
+        if rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False):
+        """Lock across the processes sharing the cache directory (exclusive for writers)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _touch(self, key: str) -> None:
+        self._tick += 1
+        self._used[key] = self._tick
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up vectors by key, returning None for misses (blocking, call off the event loop)."""
+        found: List[Optional[np.ndarray]] = []
+        with self._lock:
+            if any(key not in self._memory and key not in self._rows for key in keys):
+                # Another process may have embedded them since
+                with self._file_lock(shared=True):
+                    self._read_index()
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self._touch(key)
+                else:
+                    row = self._rows.get(key)
+                    if row is not None and self._mmap is not None and row < self._mmap.shape[0]:
+                        vector = np.array(self._mmap[row])
+                        self._remember(key, vector)
+                        self._touch(key)
+                found.append(vector)
+        return found
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Append new vectors to the persistent store and the memory tier (blocking, call off the event loop)."""
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._read_index()
+            if self._dim is None:
+                self._dim = int(matrix.shape[1])
+                with open(self._meta_path, "w") as f:
+                    json.dump({"model": self.model, "dim": self._dim, "generation": self._generation}, f)
+            if matrix.shape[1] != self._dim:
+                logger.warning(f"Skipping cache write: got dim {matrix.shape[1]}, cache has {self._dim}")
+                return
+            new = [(key, vector) for key, vector in zip(keys, matrix) if key not in self._rows]
+            if not new:
+                return
+            start = os.path.getsize(self._vectors_path) // (4 * self._dim) if os.path.exists(self._vectors_path) else 0
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.stack([vector for _, vector in new]).tobytes())
+            with open(self._index_path, "a") as f:
+                f.writelines(f"{key}\t{start + offset}\n" for offset, (key, _) in enumerate(new))
+            # Nobody else appended while the lock was held
+            self._index_offset = os.path.getsize(self._index_path)
+            for offset, (key, vector) in enumerate(new):
+                self._rows[key] = start + offset
+                self._remember(key, vector)
+                self._touch(key)
+            if (start + len(new)) * 4 * self._dim > self.max_bytes:
+                self._compact()
+            else:
+                self._remap()
+        logger.debug(f"Embedding cache stored {len(new)} vectors ({len(self._rows)} total)")
+
+    def _compact(self) -> None:
+        """Rewrite the files with the most recently used rows filling COMPACT_TARGET of max_bytes (both locks held)."""
+        self._remap()
+        keep = max(1, int(self.max_bytes * COMPACT_TARGET) // (4 * self._dim))
+        # Recency as seen by this process; rows it never used rank by insertion order
+        ranked = sorted(self._rows, key=lambda key: (self._used.get(key, -1), self._rows[key]), reverse=True)[:keep]
+        ranked.sort(key=self._rows.__getitem__)
+        with open(self._vectors_path + ".tmp", "wb") as f:
+            for start in range(0, len(ranked), COMPACT_BLOCK_ROWS):
+                block = ranked[start:start + COMPACT_BLOCK_ROWS]
+                f.write(np.ascontiguousarray(self._mmap[[self._rows[key] for key in block]]).tobytes())
+        with open(self._index_path + ".tmp", "w") as f:
+            f.writelines(f"{key}\t{row}\n" for row, key in enumerate(ranked))
+        dropped = len(self._rows) - len(ranked)
+        self._mmap = None
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        os.replace(self._index_path + ".tmp", self._index_path)
+        self._generation += 1
+        with open(self._meta_path + ".tmp", "w") as f:
+            json.dump({"model": self.model, "dim": self._dim, "generation": self._generation}, f)
+        os.replace(self._meta_path + ".tmp", self._meta_path)
+        self._rows = {key: row for row, key in enumerate(ranked)}
+        self._used = {key: tick for key, tick in self._used.items() if key in self._rows}
+        self._index_offset = os.path.getsize(self._index_path)
+        self._remap()
+        logger.info(f"Embedding cache compacted to {len(self._rows)} vectors, dropped {dropped} least recently used")
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model."""
+
+    def __init__(self, underlying: Embeddings, model: str, embedding_cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model = model
+        self.cache = embedding_cache
+
+    def _lookup(self, texts: List[str]):
+        keys = [embedding_key(text, self.model) for text in texts]
+        vectors = self.cache.get_many(keys)
+        # Identical texts in one batch are embedded once
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        hits = len(texts) - sum(v is None for v in vectors)
+        metrics.record_cache("embedding", "hit", hits)
+        metrics.record_cache("embedding", "miss", len(texts) - hits)
+        logger.info(f"Embedding cache: {hits} hits, {len(missing)} to embed")
+        return keys, vectors, missing
+
+    def _merge(self, keys, vectors, missing: Dict[str, str], embedded: List[List[float]]) -> List[List[float]]:
+        self.cache.put_many(list(missing), embedded)
+        fresh = dict(zip(missing, embedded))
+        return [
+            [float(x) for x in vector] if vector is not None else list(fresh[key])
+            for key, vector in zip(keys, vectors)
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        embedded = self.underlying.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, vectors, missing, embedded)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Cache reads and appends do file I/O and wait on the lock file other workers share
+        keys, vectors, missing = await executors.run_io(self._lookup, texts)
+        embedded = await self.underlying.aembed_documents(list(missing.values())) if missing else []
+        return await executors.run_io(self._merge, keys, vectors, missing, embedded)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class EmbeddingBatcher(Embeddings):
+    """
+    Merges embedding requests from concurrent callers into shared batches.
+
+    Async requests are queued; a worker collects them until max_batch_size
+    texts are pending or max_wait seconds have passed, sends one request to
+    the underlying model and resolves each caller's future with its slice.
+    Requests go through the resilience policy of dependency, when set.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_wait: float = EMBEDDING_BATCH_WAIT_MS / 1000,
+        max_concurrent_batches: int = EMBEDDING_MAX_CONCURRENT_BATCHES,
+        dependency: Optional[str] = "ollama"
+    ):
+        self.underlying = underlying
+        self.dependency = dependency
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrent_batches = max_concurrent_batches
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # Queues and tasks belong to one event loop
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            await self._slots.acquire()
+            task = loop.create_task(self._flush(pending))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.max_batch_size):
+            batch = texts[start:start + self.max_batch_size]
+            if self.dependency:
+                vectors.extend(await resilience.call(self.dependency, self.underlying.aembed_documents, batch))
+            else:
+                vectors.extend(await self.underlying.aembed_documents(batch))
+        return vectors
+
+    async def _flush(self, pending: List[Tuple[List[str], asyncio.Future]]) -> None:
+        try:
+            pending = [(texts, future) for texts, future in pending if not future.done()]
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            if not texts:
+                return
+            logger.info(f"Embedding batch of {len(texts)} texts from {len(pending)} requests")
+            call = asyncio.ensure_future(self._embed(texts))
+
+            def abandon(_: asyncio.Future) -> None:
+                # Every caller gave up (e.g. at its deadline): free the batch slot instead of waiting on the model
+                if not call.done() and all(future.done() for _, future in pending):
+                    call.cancel()
+
+            for _, future in pending:
+                future.add_done_callback(abandon)
+            with metrics.in_flight.track(kind="embed_batch"):
+                try:
+                    vectors = await call
+                except asyncio.CancelledError:
+                    if all(future.done() for _, future in pending):
+                        logger.warning(f"Embedding batch of {len(texts)} texts abandoned by its callers")
+                        return
+                    raise
+            offset = 0
+            for item_texts, future in pending:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+        except Exception as e:
+            logger.error(f"Embedding batch failed: {str(e)}")
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(texts), future))
+        return await future
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Synchronous callers have no event loop to batch on
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+class HashingEmbeddings(Embeddings):
+    """
+    In-process hashing-trick embedder: no model, no service.
+
+    Word unigrams and bigrams are hashed into dim signed buckets with
+    sublinear term frequency and the vector is L2 normalized. Similarity is
+    lexical rather than semantic, in exchange for sub-millisecond embedding
+    that keeps working offline.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_HASH_DIM):
+        self.dim = dim
+
+    @staticmethod
+    @lru_cache(maxsize=1 << 16)
+    def _bucket(feature: str) -> Tuple[int, float]:
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        return value >> 1, 1.0 if value & 1 else -1.0
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = lexical.tokenize(text)
+        features = Counter(tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])])
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in features.items():
+            bucket, sign = self._bucket(feature)
+            vector[bucket % self.dim] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await executors.run_cpu(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class OnnxEmbeddings(Embeddings):
+    """
+    In-process transformer embedder running an ONNX export on the CPU.
+
+    Needs onnxruntime and tokenizers, and a directory holding model.onnx and
+    tokenizer.json (e.g. an ONNX export of mxbai-embed-large-v1).
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_ONNX_PATH,
+        pooling: str = EMBEDDING_ONNX_POOLING,
+        max_tokens: int = EMBEDDING_ONNX_MAX_TOKENS,
+        batch_size: int = EMBEDDING_ONNX_BATCH_SIZE
+    ):
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"Unknown pooling '{pooling}', expected cls or mean")
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx embedding provider needs onnxruntime and tokenizers installed") from e
+        self.pooling = pooling
+        self.batch_size = batch_size
+        self.session = onnxruntime.InferenceSession(os.path.join(path, "model.onnx"), providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+        logger.info(f"Loaded ONNX embedding model from {path}")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await executors.run_cpu(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+def create_ollama_client(model: str = EMBEDDING_MODEL) -> OllamaEmbeddings:
+    """Ollama client whose HTTP connections are pooled and kept alive across requests."""
+    limits = httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+    return OllamaEmbeddings(
+        model=model,
+        base_url=OLLAMA_BASE_URL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        client_kwargs={"limits": limits, "timeout": OLLAMA_TIMEOUT}
+    )
+
+def embedding_model_id(provider: str = EMBEDDING_PROVIDER, model: str = EMBEDDING_MODEL) -> str:
+    """Name of the vector space a provider produces, used for caches and saved corpora."""
+    if provider == "hashing":
+        return f"hashing-{EMBEDDING_HASH_DIM}"
+    if provider == "onnx":
+        return f"onnx-{os.path.basename(os.path.normpath(EMBEDDING_ONNX_PATH))}-{EMBEDDING_ONNX_POOLING}"
+    return model
+
+_embeddings: Dict[str, Embeddings] = {}
+
+def get_embeddings(model: str = EMBEDDING_MODEL, provider: str = EMBEDDING_PROVIDER) -> Embeddings:
+    """
+    Return the shared embeddings of a provider.
+
+    "ollama" is one pooled client behind the micro-batcher and "onnx" a CPU
+    model in this process, both behind the embedding cache. "hashing" is
+    cheaper to recompute than to look up and is used as is.
+    """
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{provider}', expected one of {', '.join(EMBEDDING_PROVIDERS)}")
+    model_id = embedding_model_id(provider, model)
+    if model_id not in _embeddings:
+        if provider == "hashing":
+            _embeddings[model_id] = HashingEmbeddings()
+            return _embeddings[model_id]
+        if provider == "onnx":
+            # Local inference has no remote failures to retry or trip a breaker on
+            batcher = EmbeddingBatcher(OnnxEmbeddings(), dependency=None)
+        else:
+            batcher = EmbeddingBatcher(create_ollama_client(model))
+        if EMBEDDING_CACHE_ENABLED:
+            _embeddings[model_id] = CachedEmbeddings(batcher, model_id, EmbeddingCache(model_id))
+        else:
+            _embeddings[model_id] = batcher
+        logger.info(f"Using {provider} embeddings ({model_id})")
+    return _embeddings[model_id]
@@ -0,0 +1,181 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Dict, Optional, Union
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", "32"))
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", str(os.cpu_count() or 4)))
+LOOP_WATCHDOG_MS = float(os.getenv("LOOP_WATCHDOG_MS", "0"))  # 0 disables the watchdog
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(os.cpu_count() or 4)))  # 0 disables the pool
+PROCESS_POOL_MAX_PENDING = int(os.getenv("PROCESS_POOL_MAX_PENDING", str(PROCESS_POOL_SIZE * 4)))
+PROCESS_POOL_MIN_BYTES = int(os.getenv("PROCESS_POOL_MIN_BYTES", str(64 * 1024)))
+
+# Blocking network and disk calls (Exa client, SQLite, file writes)
+io_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+# CPU-heavy work that releases the GIL or is too small for a process hop (FAISS, small pages)
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+
+async def run_io(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking I/O call on the I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+async def run_cpu(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run CPU-bound work on the CPU thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(func, *args, **kwargs))
+
+def _run_on_shared_buffer(func: Callable[..., Any], name: str, size: int, *args: Any) -> Any:
+    """Worker side: call func on a view of a shared memory block, without copying it"""
+    block = shared_memory.SharedMemory(name=name)
+    view = block.buf[:size]
+    try:
+        return func(view, *args)
+    finally:
+        view.release()
+        block.close()
+
+class ProcessStage:
+    """
+    Process pool stage for CPU-bound work on large buffers (parse, clean, split).
+
+    Payloads are written once into a shared memory block and workers read
+    them in place, instead of pickling every page body through a pipe.
+    Submissions are bounded per event loop so a burst of requests queues on
+    the semaphore rather than in the pool. Small payloads, a disabled pool
+    or a broken pool fall back to the in-process CPU thread pool.
+    """
+
+    def __init__(
+        self,
+        workers: int = PROCESS_POOL_SIZE,
+        max_pending: int = PROCESS_POOL_MAX_PENDING,
+        min_bytes: int = PROCESS_POOL_MIN_BYTES
+    ):
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self.min_bytes = min_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._slots: Dict[int, asyncio.Semaphore] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Never fork a process that already runs threads and an event loop
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+                logger.info(f"Started process pool with {self.workers} workers")
+            return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(id(loop))
+        if slots is None:
+            slots = self._slots[id(loop)] = asyncio.Semaphore(self.max_pending)
+        return slots
+
+    async def run(self, func: Callable[..., Any], payload: Union[bytes, bytearray], *args: Any) -> Any:
+        """Run func(payload, *args), in a worker process when the payload is large enough"""
+        if self.workers <= 0 or len(payload) < self.min_bytes:
+            return await run_cpu(func, payload, *args)
+        async with self._get_slots():
+            block = shared_memory.SharedMemory(create=True, size=len(payload))
+            try:
+                block.buf[:len(payload)] = payload
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._get_executor(),
+                    functools.partial(_run_on_shared_buffer, func, block.name, len(payload), *args)
+                )
+            except BrokenProcessPool as e:
+                logger.error(f"Process pool broken, running in-process: {str(e)}")
+                with self._lock:
+                    self._executor = None
+                return await run_cpu(func, payload, *args)
+            finally:
+                block.close()
+                block.unlink()
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+process_stage = ProcessStage()
+
+class LoopWatchdog:
+    """
+    Detects event loop stalls and logs what the loop thread was doing.
+
+    A callback on the loop records a heartbeat every interval; a monitor
+    thread logs the loop thread's stack whenever the heartbeat is older than
+    the threshold, once per stall.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: float):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000
+        self.interval = max(self.threshold / 4, 0.005)
+        self.stalls = 0
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def _beat(self) -> None:
+        self._last_beat = time.monotonic()
+        if not self._stop.is_set():
+            self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stop.wait(self.interval):
+            lag = time.monotonic() - self._last_beat
+            if lag < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(f"Event loop blocked for more than {lag * 1000:.0f} ms:\n{stack}")
+
+    def start(self) -> None:
+        """Start watching; must be called from the event loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._beat()
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+        logger.info(f"Event loop watchdog started (threshold: {self.threshold * 1000:.0f} ms)")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+_watchdogs: Dict[int, LoopWatchdog] = {}
+
+def start_watchdog(threshold_ms: float = LOOP_WATCHDOG_MS) -> Optional[LoopWatchdog]:
+    """Start the watchdog for the running loop once, if a threshold is configured"""
+    if threshold_ms <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    watchdog = _watchdogs.get(id(loop))
+    if watchdog is None or watchdog.loop is not loop:
+        watchdog = LoopWatchdog(loop, threshold_ms)
+        watchdog.start()
+        _watchdogs[id(loop)] = watchdog
+    return watchdog
@@ -0,0 +1,179 @@
+from bs4 import BeautifulSoup
+from typing import Dict, List, Optional, Union
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "auto")  # auto, selectolax, lxml or bs4
+MIN_MAIN_CONTENT_CHARS = 200
+MIN_PARAGRAPH_CHARS = 25
+
+# Elements that never hold readable page content
+NOISE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "form", "button", "select"]
+# Page chrome dropped when looking for the main content
+CHROME_TAGS = ["nav", "header", "footer", "aside"]
+# Elements rendered on their own line
+BLOCK_TAGS = {
+    "address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "h1", "h2", "h3",
+    "h4", "h5", "h6", "hr", "li", "main", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"
+}
+
+def _clean_lines(text: str) -> str:
+    """Strip every line and drop empty ones."""
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+class Extractor:
+    """Turns an HTML page into newline separated text."""
+    name = "base"
+
+    def extract(self, html: str) -> str:
+        raise NotImplementedError
+
+class BeautifulSoupExtractor(Extractor):
+    """Full-page extraction with BeautifulSoup's pure Python parser (the reference path)."""
+    name = "bs4"
+
+    def extract(self, html: str) -> str:
+        soup = BeautifulSoup(html, 'html.parser')
+
+        # Remove script and style elements
+        for script in soup(["script", "style"]):
+            script.decompose()
+
+        # Get text content
+        text = soup.get_text(separator='\n', strip=True)
+        return _clean_lines(text)
+
+class LxmlExtractor(Extractor):
+    """
+    libxml2-based extraction with readability-style main content detection.
+
+    Paragraph-like elements score their parent (and half their grandparent)
+    by length and comma count; the best container, discounted by its link
+    density, is used as the main content. Pages without a clear winner fall
+    back to the whole body.
+    """
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+        from lxml import etree
+        self._html = lxml.html
+        self._etree = etree
+
+    def _link_density(self, node) -> float:
+        text_length = len(node.text_content()) or 1
+        link_length = sum(len(link.text_content()) for link in node.iter("a"))
+        return link_length / text_length
+
+    def _main_content(self, body):
+        for candidate in body.xpath("//article | //main | //*[@role='main']"):
+            if len(candidate.text_content()) >= MIN_MAIN_CONTENT_CHARS:
+                return candidate
+
+        scores: Dict = {}
+        for paragraph in body.iter("p", "pre", "td", "blockquote"):
+            text = paragraph.text_content()
+            if len(text) < MIN_PARAGRAPH_CHARS:
+                continue
+            score = 1 + text.count(",") + min(len(text) // 100, 3)
+            parent = paragraph.getparent()
+            if parent is None:
+                continue
+            scores[parent] = scores.get(parent, 0) + score
+            grandparent = parent.getparent()
+            if grandparent is not None:
+                scores[grandparent] = scores.get(grandparent, 0) + score / 2
+        if not scores:
+            return body
+        best = max(scores, key=lambda node: scores[node] * (1 - self._link_density(node)))
+        if len(best.text_content()) < MIN_MAIN_CONTENT_CHARS:
+            return body
+        return best
+
+    def extract(self, html: str) -> str:
+        if not html.strip():
+            return ""
+        document = self._html.document_fromstring(html)
+        self._etree.strip_elements(document, *NOISE_TAGS, self._etree.Comment, with_tail=False)
+        body = document.find("body")
+        if body is None:
+            body = document
+        main = self._main_content(body)
+        if main is body:
+            self._etree.strip_elements(body, *CHROME_TAGS, with_tail=False)
+        for element in main.iter(*BLOCK_TAGS):
+            element.text = "\n" + (element.text or "")
+            element.tail = "\n" + (element.tail or "")
+        return _clean_lines(main.text_content())
+
+class SelectolaxExtractor(Extractor):
+    """Extraction with the selectolax lexbor parser, preferring article/main elements."""
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def extract(self, html: str) -> str:
+        tree = self._parser(html)
+        tree.strip_tags(NOISE_TAGS)
+        main = None
+        for candidate in tree.css("article, main, [role=main]"):
+            if len(candidate.text(strip=True)) >= MIN_MAIN_CONTENT_CHARS:
+                main = candidate
+                break
+        if main is None:
+            tree.strip_tags(CHROME_TAGS)
+            main = tree.body or tree.root
+        if main is None:
+            return ""
+        return _clean_lines(main.text(separator="\n", strip=True))
+
+EXTRACTORS = {
+    "selectolax": SelectolaxExtractor,
+    "lxml": LxmlExtractor,
+    "bs4": BeautifulSoupExtractor,
+}
+
+_extractors: Dict[str, Extractor] = {}
+
+def get_extractor(name: str = HTML_EXTRACTOR) -> Extractor:
+    """Return an extractor by name; "auto" picks the fastest installed backend."""
+    names: List[str] = list(EXTRACTORS) if name == "auto" else [name, "bs4"]
+    for candidate in names:
+        if candidate in _extractors:
+            return _extractors[candidate]
+        if candidate not in EXTRACTORS:
+            logger.warning(f"Unknown HTML extractor '{candidate}'")
+            continue
+        try:
+            _extractors[candidate] = EXTRACTORS[candidate]()
+        except ImportError:
+            logger.info(f"HTML extractor '{candidate}' is not installed")
+            continue
+        logger.info(f"Using HTML extractor '{candidate}'")
+        return _extractors[candidate]
+    return _extractors.setdefault("bs4", BeautifulSoupExtractor())
+
+def extract_text(html: str, extractor: Optional[Extractor] = None) -> str:
+    """Extract page text, falling back to BeautifulSoup when a fast backend fails."""
+    extractor = extractor or get_extractor()
+    try:
+        text = extractor.extract(html)
+    except Exception as e:
+        logger.warning(f"{extractor.name} extraction failed, falling back to bs4: {str(e)}")
+        text = ""
+    if not text and extractor.name != "bs4":
+        text = get_extractor("bs4").extract(html)
+    return text
+
+def extract_buffer(buffer: Union[bytes, memoryview], encoding: str = "utf-8", content_type: str = "text/html") -> str:
+    """Decode a raw page body and extract its text (process pool entry point)."""
+    text = str(buffer, encoding, "replace")
+    if content_type == "text/plain":
+        return _clean_lines(text)
+    return extract_text(text)
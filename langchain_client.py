@@ -2,11 +2,14 @@ import asyncio
 import nest_asyncio
 from langchain_ollama import ChatOllama
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp import ClientSession
+from mcp.client.sse import sse_client
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, HumanMessagePromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 import httpx
 from langchain.tools import Tool
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable, Callable, Dict
+import json
 import logging
 
 # Configure logging
@@ -113,7 +116,7 @@ class LangchainMCPClient:
             # Create wrapper for search_and_analyze
             async def search_and_analyze_wrapper(query: str):
                 try:
-                    tool = mcp_tools[0]  # search_and_analyze tool
+                    tool = next(t for t in mcp_tools if t.name == "search_and_analyze")
                     result = await tool.ainvoke({
                         "query": query,
                         "num_results": 10,
@@ -149,8 +152,45 @@ class LangchainMCPClient:
             logger.error(f"Error initializing agent: {str(e)}")
             raise
 
-    async def process_message(self, user_input: str) -> str:
-        """Process a single user message"""
+    async def stream_search_and_analyze(
+        self,
+        query: str,
+        on_update: Callable[[Dict[str, Any]], Awaitable[None]]
+    ) -> Any:
+        """Call search_and_analyze in streaming mode, passing partial results to on_update"""
+        url = self.mcp_client.connections["default"]["url"]
+        
+        async def on_log_message(params):
+            # Partial results arrive as structured log notifications
+            if isinstance(params.data, dict) and "event" in params.data:
+                await on_update(params.data)
+            else:
+                logger.debug(f"Server log: {params.data}")
+        
+        async def on_progress(progress: float, total: Optional[float], message: Optional[str] = None):
+            await on_update({"event": "progress", "progress": progress, "total": total, "message": message})
+        
+        async with sse_client(url) as (read, write):
+            async with ClientSession(read, write, logging_callback=on_log_message) as session:
+                await session.initialize()
+                result = await session.call_tool(
+                    "search_and_analyze",
+                    {"query": query, "num_results": 10, "rag_results": 5, "stream": True},
+                    progress_callback=on_progress
+                )
+        
+        text = "".join(item.text for item in result.content if getattr(item, "text", None))
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return text
+
+    async def process_message(
+        self,
+        user_input: str,
+        on_update: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+    ) -> str:
+        """Process a single user message, streaming partial results to on_update if given"""
         try:
             logger.info(f"\n{'='*50}")
             logger.info("PROCESSING NEW QUERY")
@@ -158,8 +198,11 @@ class LangchainMCPClient:
             logger.info(f"User Query: {user_input}")
             
             # Call the search_and_analyze tool
-            tool = self.tools[0]
-            result = await tool.coroutine(user_input)
+            if on_update is not None:
+                result = await self.stream_search_and_analyze(user_input, on_update)
+            else:
+                tool = self.tools[0]
+                result = await tool.coroutine(user_input)
             
             # Log raw result
             logger.info(f"\n{'='*50}")
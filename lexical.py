@@ -0,0 +1,106 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import heapq
+import math
+import os
+import re
+import threading
+
+# Constants
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; model numbers like "RTX-4090" become "rtx", "4090"."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over chunk ids.
+
+    Postings map each term to the chunks containing it and their term
+    frequency, so chunks can be added and removed individually as sources
+    are re-indexed.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, List[str]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._lengths
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Index a chunk, replacing an earlier chunk with the same id."""
+        frequencies = Counter(tokenize(text))
+        with self._lock:
+            self._remove(doc_id)
+            for term, count in frequencies.items():
+                self._postings.setdefault(term, {})[doc_id] = count
+            length = sum(frequencies.values())
+            self._lengths[doc_id] = length
+            self._terms[doc_id] = list(frequencies)
+            self._total_length += length
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(doc_id):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str, k: int = 4, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Return the k best (chunk id, score) pairs, optionally only among allowed ids."""
+        with self._lock:
+            total = len(self._lengths)
+            if total == 0:
+                return []
+            average_length = self._total_length / total or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                if allowed is not None and len(allowed) < len(postings):
+                    # Few allowed chunks: probe them instead of walking the posting list
+                    matches = ((doc_id, postings[doc_id]) for doc_id in allowed if doc_id in postings)
+                else:
+                    matches = postings.items()
+                for doc_id, frequency in matches:
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each list adds 1 / (k + rank) to the ids it contains."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
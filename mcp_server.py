@@ -1,33 +1,134 @@
 import asyncio
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 import rag
 import search
+import cache
+import chunking
+import executors
+import metrics
+import resilience
+from embeddings import get_embeddings
 import logging
-from typing import Dict, Any
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Address of this server; with workers.py, each worker's own port
+MCP_SERVER_HOST = os.getenv("MCP_SERVER_HOST", "localhost")
+MCP_SERVER_PORT = int(os.getenv("MCP_SERVER_PORT", "8000"))
+
 # Initialize MCP server
 mcp = FastMCP(
     name="web_search_rag",
     version="1.0.0",
     description="Advanced web search capability with RAG integratione.Web search capability using Exa API , Firecrawl API  that provides real-time internet search results and use RAG to search for relevant data. Supports both basic and advanced search with filtering options including domain restrictions, text inclusion requirements, and date filtering. Returns formatted results with titles, URLs, publication dates, and content summaries.",
-    host="localhost",  # Add explicit host
+    host=MCP_SERVER_HOST,
     type="sse",
-    port=8000,  # Add explicit port,
+    port=MCP_SERVER_PORT,
     timeout=30,  # Increased timeout
     keep_alive=True,  # Add keep-alive
     heartbeat_interval=5,  # Add heartbeat
     debug=True  # Add debug mode to server config instead
 )
 
+# Default latency budget of search_and_analyze in seconds (0 = no deadline)
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "0"))
+# Default retrieval mode: dense, lexical or hybrid
+SEARCH_MODE = os.getenv("SEARCH_MODE", "dense")
+# batch_search_and_analyze: queries accepted per call and Exa searches run at once
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+BATCH_SEARCH_CONCURRENCY = int(os.getenv("BATCH_SEARCH_CONCURRENCY", "8"))
+
+# Logger name carried by partial results streamed to clients
+STREAM_LOGGER = "search_and_analyze"
+
+def format_rag_results(documents: List[Any]) -> List[Dict[str, Any]]:
+    """Format retrieved chunks for the tool response"""
+    return [
+        {
+            "content": doc.page_content,
+            "metadata": {"source": doc.metadata.get("source", "unknown source")}
+        } for doc in documents
+    ]
+
+async def send_partial_result(ctx: Context, event: str, payload: Dict[str, Any]) -> None:
+    """Send a partial result to the client as an MCP log notification"""
+    try:
+        await ctx.session.send_log_message(
+            level="info",
+            data={"event": event, **payload},
+            logger=STREAM_LOGGER,
+            related_request_id=ctx.request_id
+        )
+    except Exception as e:
+        # A client that went away should not fail the search
+        logger.warning(f"Could not stream {event} event: {str(e)}")
+
+async def lookup_cached(
+    query_cache: cache.QueryResultCache,
+    query: str,
+    cache_params: Tuple,
+    mode: str,
+    deadline: Optional[float]
+) -> cache.QueryLookup:
+    """Query cache lookup; with no time left to embed the query, exact matches only"""
+    # Lexical mode never embeds, so it only gets exact matches
+    embed_query = None if mode == "lexical" else get_embeddings().aembed_query
+    try:
+        return await asyncio.wait_for(query_cache.lookup(query, cache_params, embed_query), resilience.time_left(deadline))
+    except asyncio.TimeoutError:
+        logger.warning(f"Deadline reached embedding the query for the cache lookup: {query}")
+        return await query_cache.lookup(query, cache_params, None)
+
+async def embed_selected(corpus: rag.Corpus, query: str, urls: List[str], deadline: Optional[float]) -> None:
+    """Selective embedding for a query, given up at the deadline (unembedded chunks stay BM25-searchable)"""
+    try:
+        await asyncio.wait_for(corpus.embed_selected(query, urls), resilience.time_left(deadline))
+    except asyncio.TimeoutError:
+        logger.warning(f"Deadline reached during selective embedding for: {query}")
+
+async def retrieve(
+    query: str,
+    corpus: rag.Corpus,
+    k: int,
+    urls: List[str],
+    mode: str,
+    deadline: Optional[float]
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Search the corpus within the deadline.
+
+    Returns the documents and the fallback mode used, if any: when the query
+    embedding does not arrive in time, the ranking falls back to BM25 only.
+    """
+    if mode == "lexical":
+        return await rag.search_rag(query, corpus, k=k, sources=urls, mode=mode), None
+    try:
+        documents = await asyncio.wait_for(
+            rag.search_rag(query, corpus, k=k, sources=urls, mode=mode), resilience.time_left(deadline)
+        )
+        return documents, None
+    except asyncio.TimeoutError:
+        logger.warning(f"Deadline reached during {mode} retrieval, falling back to lexical for: {query}")
+        return await rag.search_rag(query, corpus, k=k, sources=urls, mode="lexical"), "lexical"
+
 @mcp.tool()
 async def search_and_analyze(
     query: str,
     num_results: int = 5,
-    rag_results: int = 3
+    rag_results: int = 3,
+    stream: bool = False,
+    timings: bool = False,
+    deadline: Optional[float] = None,
+    mode: str = SEARCH_MODE,
+    chunking_options: Optional[Dict[str, Any]] = None,
+    ctx: Context = None
 ) -> Dict[str, Any]:
     """
     Search the web and analyze results using RAG
@@ -36,12 +137,69 @@ async def search_and_analyze(
         query: Search query
         num_results: Number of search results to fetch
         rag_results: Number of RAG results to return
+        stream: Send partial results (search results, indexing progress,
+            RAG hits) as notifications before the final response
+        timings: Add per-stage timings (summed milliseconds and call
+            counts) and request counts (e.g. chunks dropped by dedup) to
+            the response
+        deadline: Latency budget in seconds (default SEARCH_DEADLINE). Pages
+            still loading near the deadline are dropped and listed in
+            dropped_sources; the answer is built from the pages that arrived.
+            If the query embedding is not ready by the deadline, retrieval
+            falls back to BM25 and the response has retrieval_fallback
+        mode: Retrieval mode: "dense" (vector search), "lexical" (BM25 only,
+            nothing is embedded) or "hybrid" (both, fused by reciprocal rank)
+        chunking_options: Chunking settings overriding the server defaults,
+            e.g. {"strategy": "tokens", "max_tokens": 256, "overlap_tokens": 32}
+            or {"strategy": "chars", "chunk_size": 2000, "chunk_overlap": 200}
     """
+    if mode not in rag.SEARCH_MODES:
+        return {"error": f"Unknown mode '{mode}', expected one of {', '.join(rag.SEARCH_MODES)}"}
+    try:
+        chunking_config = chunking.ChunkingConfig.from_options(chunking_options)
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid chunking options: {str(e)}"}
+    metrics.start_request_timings()
+    budget = deadline if deadline is not None else SEARCH_DEADLINE
+    deadline_at = time.monotonic() + budget if budget > 0 else None
+    with metrics.in_flight.track(kind="search_and_analyze"), metrics.stage("total"):
+        response = await run_search_and_analyze(query, num_results, rag_results, stream, ctx, deadline_at, mode, chunking_config)
+    if timings:
+        response = {**response, "timings": metrics.request_timings(), "counts": metrics.request_counts()}
+    return response
+
+async def run_search_and_analyze(
+    query: str,
+    num_results: int,
+    rag_results: int,
+    stream: bool,
+    ctx: Optional[Context],
+    deadline: Optional[float] = None,
+    mode: str = "dense",
+    chunking_config: Optional[chunking.ChunkingConfig] = None
+) -> Dict[str, Any]:
+    """Search, index and retrieve for one query (the body of search_and_analyze)"""
     try:
         logger.info(f"Processing query: {query}")
+        stream = stream and ctx is not None
+        # Debug aid: report event loop stalls when LOOP_WATCHDOG_MS is set
+        executors.start_watchdog()
+        
+        # Answer repeated and near-identical questions from the result cache
+        query_cache = cache.get_query_cache()
+        chunking_config = chunking_config or chunking.DEFAULT_CONFIG
+        cache_params = (num_results, rag_results, mode, chunking_config.key())
+        lookup = None
+        if query_cache:
+            lookup = await lookup_cached(query_cache, query, cache_params, mode, deadline)
+            metrics.record_cache("query", {"exact": "hit", "similar": "near_hit"}.get(lookup.match, "miss"))
+            if lookup.response is not None:
+                if stream:
+                    await send_partial_result(ctx, "search_results", {"search_results": lookup.response["search_results"]})
+                return {**lookup.response, "cache": {"match": lookup.match, "similarity": lookup.similarity}}
         
         # Perform web search
-        formatted_results, raw_results = await search.search_web(query, num_results)
+        formatted_results, raw_results = await search.search_web(query, num_results, deadline=deadline)
         if not raw_results:
             return {"error": "No search results found"}
             
@@ -49,28 +207,273 @@ async def search_and_analyze(
         urls = [result.url for result in raw_results if hasattr(result, 'url')]
         if not urls:
             return {"error": "No valid URLs found"}
+        
+        # Search results are ready long before the RAG analysis
+        total_steps = len(urls) + 2
+        if stream:
+            await send_partial_result(ctx, "search_results", {"search_results": formatted_results})
+            await ctx.report_progress(1, total_steps, "Search results ready")
+        
+        pages_done = 0
+        
+        async def on_page_indexed(source: str) -> None:
+            nonlocal pages_done
+            pages_done += 1
+            await ctx.report_progress(1 + pages_done, total_steps, f"Indexed {source}")
+        
+        dropped_sources: List[Dict[str, str]] = []
+        
+        async def on_page_dropped(source: str, reason: str) -> None:
+            dropped_sources.append({"source": source, "reason": reason})
+            if stream:
+                await send_partial_result(ctx, "source_dropped", {"source": source, "reason": reason})
             
-        # Create and query RAG system
-        vectorstore = await rag.create_rag(urls)
-        rag_results = await rag.search_rag(query, vectorstore, k=rag_results)
+        # Stream new pages into the persistent corpus, then search this query's sources
+        selective = rag.SELECTIVE_EMBEDDING and mode != "lexical"
+        corpus = await rag.update_corpus(
+            urls,
+            on_page_indexed=on_page_indexed if stream else None,
+            deadline=deadline,
+            on_page_dropped=on_page_dropped,
+            embed=mode != "lexical" and not selective,
+            chunking_config=chunking_config
+        )
+        if selective:
+            # Only the chunks BM25 finds promising for this query are embedded
+            await embed_selected(corpus, query, urls, deadline)
+        rag_results, fallback = await retrieve(query, corpus, rag_results, urls, mode, deadline)
+        rag_analysis = format_rag_results(rag_results)
+        
+        if stream:
+            for rank, item in enumerate(rag_analysis, 1):
+                await send_partial_result(ctx, "rag_result", {"rank": rank, "result": item})
+            await ctx.report_progress(total_steps, total_steps, "Analysis complete")
         
         # Format response
         response = {
             "search_results": formatted_results,
-            "rag_analysis": [
-                {
-                    "content": doc.page_content,
-                    "metadata": {"source": doc.metadata.get("source", "unknown source")}
-                } for doc in rag_results
-            ]
+            "rag_analysis": rag_analysis
         }
         
+        # Answers cut short by the deadline are not cached
+        if query_cache and not fallback and not any(item["reason"] == "deadline" for item in dropped_sources):
+            query_cache.put(query, cache_params, response, lookup.vector)
+        if dropped_sources:
+            response = {**response, "dropped_sources": dropped_sources}
+        if fallback:
+            response = {**response, "retrieval_fallback": fallback}
         return response
         
     except Exception as e:
         logger.error(f"Error in search_and_analyze: {str(e)}")
         return {"error": str(e)}
 
+@mcp.tool()
+async def batch_search_and_analyze(
+    queries: List[str],
+    num_results: int = 5,
+    rag_results: int = 3,
+    stream: bool = False,
+    timings: bool = False,
+    deadline: Optional[float] = None,
+    mode: str = SEARCH_MODE,
+    chunking_options: Optional[Dict[str, Any]] = None,
+    ctx: Context = None
+) -> Dict[str, Any]:
+    """
+    Search the web and analyze results using RAG for many related queries
+    
+    The Exa searches run concurrently; the URLs of all queries are
+    de-duplicated, so every page is fetched, chunked and embedded once into
+    the shared corpus, and each query is then answered from its own
+    sources, exactly as it would be alone. Work grows with the number of
+    unique pages, not of queries.
+    
+    Args:
+        queries: Search queries (at most BATCH_MAX_QUERIES)
+        num_results: Number of search results to fetch per query
+        rag_results: Number of RAG results to return per query
+        stream: Send each query's answer as a notification as soon as it is ready
+        timings: Add per-stage timings and request counts for the whole batch
+        deadline: Latency budget in seconds for the whole batch (default
+            SEARCH_DEADLINE)
+        mode: Retrieval mode: "dense", "lexical" or "hybrid"
+        chunking_options: Chunking settings overriding the server defaults
+    
+    Returns one result per query, in order, each shaped like a
+    search_and_analyze response with the query added, plus batch stats.
+    """
+    if not queries or not all(query.strip() for query in queries):
+        return {"error": "No queries given, or an empty query"}
+    if len(queries) > BATCH_MAX_QUERIES:
+        return {"error": f"Too many queries ({len(queries)}), at most {BATCH_MAX_QUERIES} per batch"}
+    if mode not in rag.SEARCH_MODES:
+        return {"error": f"Unknown mode '{mode}', expected one of {', '.join(rag.SEARCH_MODES)}"}
+    try:
+        chunking_config = chunking.ChunkingConfig.from_options(chunking_options)
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid chunking options: {str(e)}"}
+    metrics.start_request_timings()
+    budget = deadline if deadline is not None else SEARCH_DEADLINE
+    deadline_at = time.monotonic() + budget if budget > 0 else None
+    with metrics.in_flight.track(kind="batch_search_and_analyze"), metrics.stage("total"):
+        response = await run_batch_search_and_analyze(
+            queries, num_results, rag_results, stream, ctx, deadline_at, mode, chunking_config
+        )
+    if timings:
+        response = {**response, "timings": metrics.request_timings(), "counts": metrics.request_counts()}
+    return response
+
+async def run_batch_search_and_analyze(
+    queries: List[str],
+    num_results: int,
+    rag_results: int,
+    stream: bool,
+    ctx: Optional[Context],
+    deadline: Optional[float] = None,
+    mode: str = "dense",
+    chunking_config: Optional[chunking.ChunkingConfig] = None
+) -> Dict[str, Any]:
+    """Search all queries, index the union of their pages once, then retrieve per query"""
+    try:
+        logger.info(f"Processing batch of {len(queries)} queries")
+        stream = stream and ctx is not None
+        executors.start_watchdog()
+        chunking_config = chunking_config or chunking.DEFAULT_CONFIG
+        cache_params = (num_results, rag_results, mode, chunking_config.key())
+        query_cache = cache.get_query_cache()
+        # Repeated queries in a batch are answered once
+        unique_queries = list(dict.fromkeys(query.strip() for query in queries))
+        answers: Dict[str, Dict[str, Any]] = {}
+        lookups: Dict[str, Any] = {}
+        
+        async def answer(query: str, response: Dict[str, Any]) -> None:
+            answers[query] = response
+            if stream:
+                await send_partial_result(ctx, "query_result", {"query": query, **response})
+                await ctx.report_progress(len(answers), len(unique_queries), f"Answered {query}")
+        
+        if query_cache:
+            found = await asyncio.gather(*(
+                lookup_cached(query_cache, query, cache_params, mode, deadline) for query in unique_queries
+            ))
+            for query, lookup in zip(unique_queries, found):
+                metrics.record_cache("query", {"exact": "hit", "similar": "near_hit"}.get(lookup.match, "miss"))
+                lookups[query] = lookup
+                if lookup.response is not None:
+                    await answer(query, {**lookup.response, "cache": {"match": lookup.match, "similarity": lookup.similarity}})
+        pending = [query for query in unique_queries if query not in answers]
+        
+        # Exa searches for all remaining queries, a few at a time
+        searches = asyncio.Semaphore(BATCH_SEARCH_CONCURRENCY)
+        
+        async def search_one(query: str):
+            async with searches:
+                return await search.search_web(query, num_results, deadline=deadline)
+        
+        searched = await asyncio.gather(*(search_one(query) for query in pending))
+        query_urls: Dict[str, List[str]] = {}
+        formatted: Dict[str, str] = {}
+        for query, (formatted_results, raw_results) in zip(pending, searched):
+            urls = list(dict.fromkeys(result.url for result in raw_results if getattr(result, "url", None)))
+            if not raw_results:
+                await answer(query, {"error": "No search results found"})
+            elif not urls:
+                await answer(query, {"error": "No valid URLs found"})
+            else:
+                query_urls[query] = urls
+                formatted[query] = formatted_results
+        
+        # Every page of the batch is fetched, chunked and embedded once
+        all_urls = list(dict.fromkeys(url for urls in query_urls.values() for url in urls))
+        total_urls = sum(len(urls) for urls in query_urls.values())
+        logger.info(f"Batch needs {len(all_urls)} unique pages for {total_urls} search results")
+        dropped: Dict[str, str] = {}
+        
+        async def on_page_dropped(source: str, reason: str) -> None:
+            dropped[source] = reason
+        
+        selective = rag.SELECTIVE_EMBEDDING and mode != "lexical"
+        corpus = None
+        if all_urls:
+            corpus = await rag.update_corpus(
+                all_urls,
+                deadline=deadline,
+                on_page_dropped=on_page_dropped,
+                embed=mode != "lexical" and not selective,
+                chunking_config=chunking_config
+            )
+            if selective:
+                # Chunks promoted for one query are already embedded for the next
+                for query, urls in query_urls.items():
+                    await embed_selected(corpus, query, urls, deadline)
+        
+        async def answer_from_corpus(query: str) -> None:
+            urls = query_urls[query]
+            try:
+                # Concurrent dense searches share embedding batches
+                documents, fallback = await retrieve(query, corpus, rag_results, urls, mode, deadline)
+            except Exception as e:
+                await answer(query, {"error": str(e)})
+                return
+            response = {"search_results": formatted[query], "rag_analysis": format_rag_results(documents)}
+            dropped_sources = [{"source": url, "reason": dropped[url]} for url in urls if url in dropped]
+            if query_cache and not fallback and not any(item["reason"] == "deadline" for item in dropped_sources):
+                query_cache.put(query, cache_params, response, lookups[query].vector)
+            if dropped_sources:
+                response = {**response, "dropped_sources": dropped_sources}
+            if fallback:
+                response = {**response, "retrieval_fallback": fallback}
+            await answer(query, response)
+        
+        await asyncio.gather(*(answer_from_corpus(query) for query in query_urls))
+        return {
+            "results": [{"query": query, **answers[query.strip()]} for query in queries],
+            "stats": {
+                "queries": len(queries),
+                "unique_queries": len(unique_queries),
+                "cached": len(unique_queries) - len(pending),
+                "search_results": total_urls,
+                "unique_pages": len(all_urls),
+                "dropped_pages": len(dropped)
+            }
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in batch_search_and_analyze: {str(e)}")
+        return {"error": str(e)}
+
+
+@mcp.tool()
+async def cache_stats() -> Dict[str, Any]:
+    """Report the state and hit, near-hit and miss statistics of the server caches"""
+    query_cache = cache.get_query_cache()
+    page_cache = cache.get_page_cache()
+    return {
+        "query_cache": query_cache.stats() if query_cache else None,
+        "page_cache": page_cache.stats() if page_cache else None,
+        "exa_cache": {**search.exa_cache.stats(), "coalesced": search.exa_flights.shared}
+    }
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint, served next to the SSE transport"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def corpus_endpoint(request: Request) -> JSONResponse:
+    """Serve the RemoteCorpus calls of the other workers on this worker's corpus (workers.py)"""
+    try:
+        result = await rag.serve_corpus_call(rag.get_corpus(), request.path_params["operation"], await request.json())
+        return JSONResponse({"result": result})
+    except KeyError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    except Exception as e:
+        logger.error(f"Corpus call {request.path_params['operation']} failed: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+if rag.CORPUS_WRITER:
+    mcp.custom_route("/corpus/{operation}", methods=["POST"])(corpus_endpoint)
+
 async def process_query(query: str):
     """Process the search query"""
     try:
@@ -132,30 +535,5 @@ async def process_query(query: str):
 
 if __name__ == "__main__":
     print("Starting MCP server...")
-    print("Server will be available at http://localhost:8000")
+    print(f"Server will be available at http://{MCP_SERVER_HOST}:{MCP_SERVER_PORT}")
     mcp.run(transport="sse")  # Remove debug parameter from run()
-
-# Display RAG analysis in tab 2
-with tab2:
-    if analysis and analysis != "No analysis available":
-        # Split analysis into sections
-        if "Analysis:" in analysis:
-            # Remove the header first
-            analysis_content = analysis.split("Analysis:", 1)[1].strip()
-            
-            # Display the header separately
-            st.markdown("Analysis:")
-            
-            # Display the main content
-            sections = analysis_content.split("\n\n")
-            for section in sections:
-                if section.strip():
-                    if section.startswith("Sources:"):
-                        st.markdown("---")  # Add separator before sources
-                    st.markdown(section.strip())
-                    st.markdown("")  # Add spacing between sections
-        else:
-            st.markdown(analysis)
-        logger.info("Displayed RAG analysis")
-    else:
-        st.warning("No RAG analysis available for this query")
\ No newline at end of file
@@ -0,0 +1,180 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect
+import threading
+import time
+
+# Constants
+# Latency buckets in seconds, from sub-millisecond CPU work up to slow page fetches
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """Base class for a metric family with optional labels."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        """Count the enclosed block as in flight."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (last slot is +Inf), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """Holds metric families and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+stage_seconds: Histogram = registry.register(Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent per pipeline stage (search, fetch, parse, split, dedup, embed, index, retrieve, total)",
+    ["stage"]
+))
+stage_errors: Counter = registry.register(Counter(
+    "rag_stage_errors_total", "Pipeline stage calls that raised", ["stage"]
+))
+cache_requests: Counter = registry.register(Counter(
+    "rag_cache_requests_total", "Cache lookups by cache and result (hit, near_hit, revalidated, stale, miss)", ["cache", "result"]
+))
+in_flight: Gauge = registry.register(Gauge(
+    "rag_in_flight", "Requests currently in progress by kind (tool calls, page fetches, embedding calls)", ["kind"]
+))
+
+# Per-request stage timings, shared by every task the request spawns
+_request_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+_request_counts: ContextVar[Optional[Dict[str, int]]] = ContextVar("request_counts", default=None)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage into the histogram and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            entry = timings.setdefault(name, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+def record_cache(cache: str, result: str, count: int = 1) -> None:
+    if count:
+        cache_requests.inc(count, cache=cache, result=result)
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a named count of the current request (e.g. chunks dropped by dedup)."""
+    counts = _request_counts.get()
+    if counts is not None and amount:
+        counts[name] = counts.get(name, 0) + amount
+
+def start_request_timings() -> None:
+    """Start collecting stage timings and counts for the current task and the tasks it creates."""
+    _request_timings.set({})
+    _request_counts.set({})
+
+def request_timings() -> Dict[str, Dict[str, float]]:
+    """Stage timings of the current request: summed milliseconds and call counts."""
+    timings = _request_timings.get() or {}
+    return {name: {"ms": round(total * 1000, 2), "count": count} for name, (total, count) in timings.items()}
+
+def request_counts() -> Dict[str, int]:
+    """Named counts of the current request."""
+    return dict(_request_counts.get() or {})
+
+def render() -> str:
+    return registry.render()
@@ -1,17 +1,921 @@
-from langchain_ollama import OllamaEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+import aiohttp
 import asyncio
 import os
-from typing import List
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 import search
+import cache
+import chunking
+import dedup
+import executors
+import lexical
+import metrics
+import resilience
+import vector_index
+from embeddings import embedding_model_id, get_embeddings
+import hashlib
+import numpy as np
+import json
+import pickle
+import random
+import threading
 import time
+import uuid
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Persistent corpus settings
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(cache.CACHE_DIR, "corpus"))
+CORPUS_SOURCE_TTL = float(os.getenv("CORPUS_SOURCE_TTL", str(cache.PAGE_CACHE_TTL)))
+CORPUS_SAVE_INTERVAL = float(os.getenv("CORPUS_SAVE_INTERVAL", "60"))
+# Sources not requested for CORPUS_MAX_AGE seconds are evicted, then the least recently
+# requested ones while the corpus holds more than CORPUS_MAX_CHUNKS chunks (0 = no limit)
+CORPUS_MAX_AGE = float(os.getenv("CORPUS_MAX_AGE", str(7 * 24 * 3600)))
+CORPUS_MAX_CHUNKS = int(os.getenv("CORPUS_MAX_CHUNKS", "100000"))
+# Multi-worker mode (workers.py): one worker owns the corpus and serves /corpus/<operation>
+# (CORPUS_WRITER=1), the others use it through CORPUS_WRITER_URL
+CORPUS_WRITER = os.getenv("CORPUS_WRITER", "0") == "1"
+CORPUS_WRITER_URL = os.getenv("CORPUS_WRITER_URL", "")
+CORPUS_WRITER_TIMEOUT = float(os.getenv("CORPUS_WRITER_TIMEOUT", "300"))  # seconds
+FETCH_K_MULTIPLIER = 20
+# Dense and BM25 candidates per requested result fused in hybrid mode
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "4"))
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+# Selective embedding: index pages lexical-only and embed only the chunks BM25 ranks
+# highest for the query, plus a few random ones so BM25 misses can still surface
+SELECTIVE_EMBEDDING = os.getenv("SELECTIVE_EMBEDDING", "0") == "1"
+SELECTIVE_EMBED_TOP_N = int(os.getenv("SELECTIVE_EMBED_TOP_N", "20"))
+SELECTIVE_EMBED_EXPLORE = int(os.getenv("SELECTIVE_EMBED_EXPLORE", "4"))
+
+selective_chunks_total: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_selective_embed_chunks_total", "Lexical-only chunks embedded or skipped by selective embedding", ["result"]
+))
+
+# Fetch -> split -> embed pipeline settings
+PIPELINE_EMBED_WORKERS = int(os.getenv("PIPELINE_EMBED_WORKERS", "4"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# Share of a request's remaining budget kept for splitting and embedding once fetches are cut off
+DEADLINE_INDEX_RESERVE = float(os.getenv("DEADLINE_INDEX_RESERVE", "0.3"))
+
+def split_documents(documents: List[Document], chunking_config: Optional[chunking.ChunkingConfig] = None) -> List[Document]:
+    """Split documents into chunks for embedding"""
+    chunking_config = chunking_config or chunking.DEFAULT_CONFIG
+    return [
+        Document(page_content=text, metadata={**document.metadata, "chunking": chunking_config.key()})
+        for document in documents
+        for text in chunking.split_text(document.page_content, chunking_config)
+    ]
+
+async def split_documents_async(documents: List[Document], chunking_config: Optional[chunking.ChunkingConfig] = None) -> List[Document]:
+    """Split documents off the event loop, large pages in the process pool"""
+    chunking_config = chunking_config or chunking.DEFAULT_CONFIG
+    chunks: List[Document] = []
+    with metrics.stage("split"):
+        for document in documents:
+            texts = await executors.process_stage.run(chunking.split_buffer, document.page_content.encode("utf-8"), chunking_config)
+            metadata = {**document.metadata, "chunking": chunking_config.key()}
+            chunks.extend(Document(page_content=text, metadata=dict(metadata)) for text in texts)
+    return chunks
+
+async def prepare_chunks(
+    documents: List[Document],
+    chunking_config: Optional[chunking.ChunkingConfig] = None
+) -> List[Document]:
+    """Strip domain boilerplate, split, and drop chunks near-duplicating others of the same page (copies across pages are aliased by the corpus)"""
+    if not dedup.DEDUP_ENABLED:
+        return await split_documents_async(documents, chunking_config)
+    stats = dedup.DedupStats()
+    with metrics.stage("dedup"):
+        documents = await executors.run_cpu(dedup.strip_boilerplate, documents, stats)
+    chunks = await split_documents_async(documents, chunking_config)
+    with metrics.stage("dedup"):
+        chunks = await executors.run_cpu(dedup.drop_near_duplicates, chunks, stats)
+    dedup.record(stats)
+    return chunks
+
+class VectorCorpus:
+    """
+    Long-lived FAISS corpus whose chunks are managed per source URL.
+    
+    Sources can be upserted, replaced and removed without rebuilding the
+    index, the corpus can be saved to and loaded from disk, and searches can
+    be limited to a set of sources.
+    
+    The FAISS index type comes from index_spec (vector_index.FAISS_INDEX).
+    Chunks removed from index types that cannot delete in place (IVF, HNSW)
+    are tombstoned and filtered out of searches until the index is compacted.
+    embedding_id names the vector space of the embeddings, so that a corpus
+    saved with another embedding provider or model is not searched with them.
+    """
+
+    def __init__(
+        self,
+        embeddings: Optional[Embeddings] = None,
+        path: Optional[str] = None,
+        index_spec: Optional[str] = None,
+        embedding_id: Optional[str] = None
+    ):
+        self.embeddings = embeddings or get_embeddings()
+        self.path = path
+        self.index_spec = index_spec or vector_index.FAISS_INDEX
+        self.embedding_id = embedding_id or embedding_model_id()
+        self.store: Optional[FAISS] = None
+        # Deleted chunk ids still present in an index without removal support
+        self._tombstones: Set[str] = set()
+        # BM25 over every chunk; chunks indexed without embeddings live only here
+        self.lexical = lexical.BM25Index()
+        self._lexical_only: Dict[str, Document] = {}
+        # source URL -> {"ids": chunk ids, "hash": content hash, "indexed_at": timestamp, "used_at": timestamp, "embedded": bool,
+        # "simhashes": SimHash per chunk id, "aliases": chunk ids of other sources its near-duplicate chunks map to}
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        # SimHash of every stored chunk, by chunk id, to find copies of it on other pages
+        self._near_duplicates = dedup.SimHashIndex()
+        # chunk id -> sources listing it among their aliases
+        self._aliased_by: Dict[str, Set[str]] = {}
+        # chunk id -> position in the FAISS index, rebuilt when None
+        self._positions: Optional[Dict[str, int]] = None
+        self._lock = threading.RLock()
+        # Serializes saves, which write outside self._lock
+        self._save_lock = threading.Lock()
+        # FAISS index a save is writing; it is copied before being changed
+        self._saving_index: Optional[Any] = None
+        # Background thread training or compacting a new index, if any
+        self._rebuilding: Optional[threading.Thread] = None
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def __len__(self) -> int:
+        return sum(len(entry["ids"]) for entry in self._sources.values())
+
+    @property
+    def sources(self) -> List[str]:
+        return list(self._sources)
+
+    def has_fresh_source(
+        self,
+        source: str,
+        max_age: float = CORPUS_SOURCE_TTL,
+        embedded: bool = True,
+        chunking_key: Optional[str] = None
+    ) -> bool:
+        """Check whether a source is indexed (with embeddings, unless embedded=False, and with the given chunking) and younger than max_age seconds"""
+        entry = self._sources.get(source)
+        if entry is None or time.time() - entry["indexed_at"] >= max_age:
+            return False
+        if chunking_key is not None and entry.get("chunking") != chunking_key:
+            return False
+        return entry.get("embedded", True) or not embedded
+
+    async def add_documents(self, documents: List[Document], embed: bool = True) -> int:
+        """Upsert already split chunks, grouped by their source URL (lexical index only if embed is False)"""
+        grouped: Dict[str, List[Document]] = {}
+        for doc in documents:
+            grouped.setdefault(doc.metadata.get("source", "unknown source"), []).append(doc)
+        added = 0
+        for source, chunks in grouped.items():
+            added += await self.upsert_source(source, chunks, embed=embed)
+        return added
+
+    async def upsert_source(self, source: str, chunks: List[Document], embed: bool = True) -> int:
+        """Index the chunks of a source, replacing older chunks only if the content changed"""
+        digest = hashlib.sha256("\0".join(chunk.page_content for chunk in chunks).encode("utf-8")).hexdigest()
+        entry = self._sources.get(source)
+        if entry is not None and entry["hash"] == digest and (entry.get("embedded", True) or not embed):
+            entry["indexed_at"] = time.time()
+            entry["chunking"] = chunks[0].metadata.get("chunking") if chunks else None
+            logger.debug(f"Source unchanged, keeping {len(entry['ids'])} chunks for {source}")
+            return 0
+        return await self.replace_source(source, chunks, digest, embed=embed)
+
+    async def replace_source(self, source: str, chunks: List[Document], digest: Optional[str] = None, embed: bool = True) -> int:
+        """
+        Drop all chunks of a source and index the given chunks in their place.
+
+        A chunk near-duplicating a stored chunk of another source (a syndicated
+        or mirrored page) is neither embedded nor stored: the source records
+        that chunk as an alias, so searches limited to it still find the text.
+        """
+        if not chunks:
+            self.remove_source(source)
+            return 0
+        digest = digest or hashlib.sha256("\0".join(chunk.page_content for chunk in chunks).encode("utf-8")).hexdigest()
+        chunking_key = chunks[0].metadata.get("chunking")
+        fingerprints = None
+        aliases: List[str] = []
+        if dedup.DEDUP_ENABLED:
+            with metrics.stage("dedup"):
+                fingerprints = await executors.run_cpu(lambda: [dedup.simhash(chunk.page_content) for chunk in chunks])
+                originals = self._find_originals(source, fingerprints, embed)
+            if originals:
+                stats = dedup.DedupStats(chunks_in=len(chunks))
+                for position, original in originals.items():
+                    stats.duplicate_chunks += 1
+                    stats.duplicate_bytes += len(chunks[position].page_content.encode("utf-8"))
+                    if original not in aliases:
+                        aliases.append(original)
+                dedup.record(stats)
+                chunks = [chunk for position, chunk in enumerate(chunks) if position not in originals]
+                fingerprints = [fingerprint for position, fingerprint in enumerate(fingerprints) if position not in originals]
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = None
+        if embed:
+            vectors = []
+            if texts:
+                with metrics.stage("embed"):
+                    vectors = await self.embeddings.aembed_documents(texts)
+        ids = [uuid.uuid4().hex for _ in chunks]
+        metadatas = [{**chunk.metadata, "source": source, "chunk_id": chunk_id} for chunk, chunk_id in zip(chunks, ids)]
+        # FAISS updates are CPU work, keep them off the event loop
+        with metrics.stage("index"):
+            await executors.run_cpu(self._swap_source, source, texts, vectors, metadatas, ids, digest, chunking_key, fingerprints, aliases)
+        logger.info(
+            f"Indexed {len(ids)} chunks for {source}{'' if embed else ' (lexical only)'}"
+            + (f", {len(aliases)} near-duplicates of other pages aliased" if aliases else "")
+        )
+        return len(ids)
+
+    def _find_originals(self, source: str, fingerprints: List[int], embedded: bool) -> Dict[int, str]:
+        """Map positions of chunks near-duplicating a chunk of another source to that chunk's id"""
+        with self._lock:
+            own = set(self._sources.get(source, {}).get("ids", ()))
+
+            def accept(chunk_id: str) -> bool:
+                # An embedded source only aliases chunks dense search can find
+                return chunk_id not in own and not (embedded and chunk_id in self._lexical_only)
+
+            originals = {}
+            for position, fingerprint in enumerate(fingerprints):
+                original = self._near_duplicates.find(fingerprint, accept)
+                if original is not None:
+                    originals[position] = original
+            return originals
+
+    async def embed_source(self, source: str) -> int:
+        """Embed a source that was indexed lexical-only, keeping its chunk ids (and so the aliases to them)"""
+        with self._lock:
+            entry = self._sources.get(source)
+            if entry is None or entry.get("embedded", True):
+                return 0
+            # Chunks promoted by embed_selected already live in the vector store
+            documents = [self._lexical_only[chunk_id] for chunk_id in self._source_chunk_ids([source]) if chunk_id in self._lexical_only]
+        if documents:
+            with metrics.stage("embed"):
+                vectors = await self.embeddings.aembed_documents([document.page_content for document in documents])
+            with metrics.stage("index"):
+                await executors.run_cpu(self._promote_chunks, documents, vectors)
+        with self._lock:
+            if self._sources.get(source) is entry and all(chunk_id not in self._lexical_only for chunk_id in self._source_chunk_ids([source])):
+                entry["embedded"] = True
+                self._dirty = True
+        logger.info(f"Embedded {len(documents)} lexical-only chunks for {source}")
+        return len(documents)
+
+    async def embed_selected(
+        self,
+        query: str,
+        sources: Iterable[str],
+        top_n: int = SELECTIVE_EMBED_TOP_N,
+        explore: int = SELECTIVE_EMBED_EXPLORE
+    ) -> int:
+        """
+        Embed only the lexical-only chunks of sources worth scoring densely for query.
+        
+        Chunks among the top_n BM25 hits of the sources are embedded, plus
+        explore chunks sampled at random from the rest. Embedded chunks move
+        into the vector store and stay there for later queries.
+        
+        Returns:
+            int: Number of chunks embedded
+        """
+        sources = list(sources)
+        with self._lock:
+            pending = [chunk_id for chunk_id in self._source_chunk_ids(sources) if chunk_id in self._lexical_only]
+            if not pending:
+                return 0
+            pending_set = set(pending)
+            chosen = [chunk_id for chunk_id in self._lexical_ranking(query, top_n, sources) if chunk_id in pending_set]
+            chosen_set = set(chosen)
+            rest = [chunk_id for chunk_id in pending if chunk_id not in chosen_set]
+            chosen += random.sample(rest, min(explore, len(rest)))
+            documents = [self._lexical_only[chunk_id] for chunk_id in chosen]
+        skipped = len(pending) - len(documents)
+        selective_chunks_total.inc(len(documents), result="embedded")
+        selective_chunks_total.inc(skipped, result="skipped")
+        metrics.count("selective_embedded_chunks", len(documents))
+        metrics.count("selective_skipped_chunks", skipped)
+        if documents:
+            with metrics.stage("embed"):
+                vectors = await self.embeddings.aembed_documents([document.page_content for document in documents])
+            with metrics.stage("index"):
+                await executors.run_cpu(self._promote_chunks, documents, vectors)
+        logger.info(f"Selectively embedded {len(documents)} of {len(pending)} lexical-only chunks")
+        return len(documents)
+
+    def _promote_chunks(self, documents: List[Document], vectors: List[List[float]]) -> None:
+        """Move lexical-only chunks into the vector store"""
+        with self._lock:
+            # Skip chunks whose source was replaced while they were being embedded
+            kept = [
+                (document, vector)
+                for document, vector in zip(documents, vectors)
+                if self._lexical_only.get(document.metadata["chunk_id"]) is document
+            ]
+            if not kept:
+                return
+            self._add_vectors(
+                [document.page_content for document, _ in kept],
+                [vector for _, vector in kept],
+                [document.metadata for document, _ in kept],
+                [document.metadata["chunk_id"] for document, _ in kept]
+            )
+            for document, _ in kept:
+                del self._lexical_only[document.metadata["chunk_id"]]
+            self._dirty = True
+
+    def _swap_source(self, source, texts, vectors, metadatas, ids, digest, chunking_key=None, fingerprints=None, aliases=()) -> None:
+        with self._lock:
+            self._drop_chunks(source, self._sources.get(source))
+            if vectors is None:
+                for text, metadata, chunk_id in zip(texts, metadatas, ids):
+                    self._lexical_only[chunk_id] = Document(page_content=text, metadata=metadata)
+            elif texts:
+                self._add_vectors(texts, vectors, metadatas, ids)
+            self.lexical.add_many(zip(ids, texts))
+            # The original of an alias may have been dropped while this source was embedded
+            live = [chunk_id for chunk_id in aliases if self._get_chunk(chunk_id) is not None]
+            entry = self._sources[source] = {
+                "ids": ids,
+                "hash": digest or hashlib.sha256("\0".join(texts).encode("utf-8")).hexdigest(),
+                # A source that lost an alias is fetched again by the next request for it
+                "indexed_at": time.time() if len(live) == len(aliases) else 0,
+                "embedded": vectors is not None,
+                "chunking": chunking_key
+            }
+            if fingerprints is not None:
+                entry["simhashes"] = fingerprints
+            if live:
+                entry["aliases"] = live
+            self._register_chunks(source, entry)
+            self._dirty = True
+
+    def _register_chunks(self, source: str, entry: Dict[str, Any]) -> None:
+        """Add a source entry's SimHashes and aliases to the corpus-wide maps"""
+        for chunk_id, fingerprint in zip(entry["ids"], entry.get("simhashes", ())):
+            self._near_duplicates.add(chunk_id, fingerprint)
+        for chunk_id in entry.get("aliases", ()):
+            self._aliased_by.setdefault(chunk_id, set()).add(source)
+
+    def remove_source(self, source: str) -> int:
+        """Remove every chunk of a source from the corpus"""
+        with self._lock:
+            entry = self._sources.pop(source, None)
+            if entry is None:
+                return 0
+            self._drop_chunks(source, entry)
+            self._dirty = True
+        logger.info(f"Removed {len(entry['ids'])} chunks for {source}")
+        return len(entry["ids"])
+
+    def touch(self, sources: Iterable[str]) -> None:
+        """Mark sources as requested now, keeping them from eviction"""
+        now = time.time()
+        with self._lock:
+            for source in sources:
+                entry = self._sources.get(source)
+                if entry is not None:
+                    entry["used_at"] = now
+
+    def evict(
+        self,
+        max_age: float = CORPUS_MAX_AGE,
+        max_chunks: int = CORPUS_MAX_CHUNKS,
+        keep: Iterable[str] = ()
+    ) -> int:
+        """Remove sources not requested for max_age seconds, then the least recently requested beyond max_chunks chunks"""
+        keep = set(keep)
+        now = time.time()
+        with self._lock:
+            total = len(self)
+            evicted = []
+            for source in sorted(self._sources, key=lambda source: self._sources[source].get("used_at", self._sources[source]["indexed_at"])):
+                entry = self._sources[source]
+                expired = max_age > 0 and now - entry.get("used_at", entry["indexed_at"]) >= max_age
+                if not expired and not (max_chunks > 0 and total > max_chunks):
+                    break
+                if source not in keep:
+                    evicted.append(source)
+                    total -= len(entry["ids"])
+            for source in evicted:
+                self.remove_source(source)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} sources, corpus holds {total} chunks")
+        return len(evicted)
+
+    async def plan_update(self, links: List[str], embed: bool = True, chunking_key: Optional[str] = None) -> Tuple[List[str], List[str]]:
+        """
+        Mark links as requested and sort out the ones update_corpus has to index.
+
+        Returns the links to fetch and the fresh lexical-only ones that only
+        need embedding (empty when embed is False).
+        """
+        self.touch(links)
+        stale = [link for link in links if not self.has_fresh_source(link, embedded=embed, chunking_key=chunking_key)]
+        lexical_links = [link for link in stale if self.has_fresh_source(link, embedded=False, chunking_key=chunking_key)]
+        return [link for link in stale if link not in lexical_links], lexical_links
+
+    async def finish_update(self, keep: Iterable[str] = ()) -> int:
+        """Evict old sources (never those in keep) and save if due; returns the chunk count"""
+        await executors.run_cpu(self.evict, keep=keep)
+        await executors.run_io(self.maybe_save)
+        return len(self)
+
+    def _add_vectors(self, texts, vectors, metadatas, ids) -> None:
+        if self.store is None:
+            index = vector_index.build(np.zeros((0, len(vectors[0])), dtype=np.float32), self.index_spec)
+            self.store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+            self._positions = None
+        self._own_index()
+        start = self.store.index.ntotal
+        self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        if self._positions is not None:
+            self._positions.update((chunk_id, start + offset) for offset, chunk_id in enumerate(ids))
+        if vector_index.is_staging(self.store.index, self.index_spec) and self.store.index.ntotal >= vector_index.FAISS_TRAIN_SIZE:
+            self._start_rebuild()
+
+    def _remove_ids(self, ids: List[str]) -> None:
+        if not ids or self.store is None:
+            return
+        if vector_index.supports_removal(self.store.index):
+            # Positions after the removed ones shift down
+            self._own_index()
+            self.store.delete(ids)
+            self._positions = None
+            return
+        self._tombstones.update(ids)
+        self._maybe_compact()
+
+    def _own_index(self) -> None:
+        """Copy the index before changing it in place while a save is writing it"""
+        if self.store is not None and self.store.index is self._saving_index:
+            self.store.index = vector_index.clone(self.store.index)
+
+    def _maybe_compact(self) -> None:
+        if self.store is not None and len(self._tombstones) > vector_index.FAISS_COMPACT_RATIO * self.store.index.ntotal:
+            self._start_rebuild(retrain=False)
+
+    def _live_vectors(self) -> Tuple[List[str], np.ndarray]:
+        """Chunk ids and vectors of the store in index order, tombstones excluded"""
+        live = [(position, chunk_id) for position, chunk_id in sorted(self.store.index_to_docstore_id.items()) if chunk_id not in self._tombstones]
+        return [chunk_id for _, chunk_id in live], vector_index.reconstruct(self.store.index, [position for position, _ in live])
+
+    def _build_index(self, vectors: np.ndarray, template: Optional[Any]) -> Any:
+        """Build for index_spec (training it once there are enough vectors), or reuse the training of template"""
+        if template is None:
+            return vector_index.build(vectors, self.index_spec)
+        template.add(vectors)
+        return template
+
+    def _rebuild_index(self, retrain: bool = True) -> None:
+        """
+        Rebuild the FAISS index from its live vectors in place, dropping tombstones.
+
+        With retrain the index is built for index_spec from scratch; otherwise
+        the current training is reused, so a compaction costs only the re-adds.
+        """
+        start = time.perf_counter()
+        ids, vectors = self._live_vectors()
+        index = self._build_index(vectors, None if retrain else vector_index.empty_like(self.store.index))
+        self._install_index(index, ids, set(), start)
+
+    def _start_rebuild(self, retrain: bool = True) -> None:
+        """
+        Rebuild the FAISS index in a background thread, as _rebuild_index does.
+
+        Training and re-adding take minutes at FAISS_TRAIN_SIZE, so the new
+        index is built without the lock from a snapshot of the live vectors
+        while searches keep using the current one. Chunks added or removed in
+        the meantime are replayed when it is swapped in. Callers hold the lock.
+        """
+        if self._rebuilding is not None:
+            return
+        ids, vectors = self._live_vectors()
+        # Cloning keeps the training; it has to happen before more vectors are added
+        template = None if retrain else vector_index.empty_like(self.store.index)
+        # A flat staging index deletes documents with its vectors; the new index may still hold them
+        documents = {chunk_id: self.store.docstore.search(chunk_id) for chunk_id in ids}
+        self._rebuilding = threading.Thread(
+            target=self._rebuild_in_background,
+            args=(self.store, ids, vectors, template, documents),
+            name="faiss-rebuild",
+            daemon=True
+        )
+        self._rebuilding.start()
+
+    def _rebuild_in_background(self, store: FAISS, ids: List[str], vectors: np.ndarray, template: Optional[Any], documents: Dict[str, Document]) -> None:
+        start = time.perf_counter()
+        try:
+            index = self._build_index(vectors, template)
+        except Exception as e:
+            logger.error(f"Failed to rebuild the FAISS index: {str(e)}")
+            with self._lock:
+                self._rebuilding = None
+            return
+        with self._lock:
+            self._rebuilding = None
+            if self.store is not store:
+                # The vectors were dropped (e.g. by _forget_vectors) while building
+                return
+            built = set(ids)
+            current = sorted(store.index_to_docstore_id.items())
+            added = [(position, chunk_id) for position, chunk_id in current if chunk_id not in built and chunk_id not in self._tombstones]
+            if added:
+                index.add(vector_index.reconstruct(store.index, [position for position, _ in added]))
+            live = {chunk_id for _, chunk_id in current if chunk_id not in self._tombstones}
+            removed = {chunk_id for chunk_id in ids if chunk_id not in live}
+            missing = {chunk_id: documents[chunk_id] for chunk_id in removed if not isinstance(store.docstore.search(chunk_id), Document)}
+            if missing:
+                store.docstore.add(missing)
+            self._install_index(index, ids + [chunk_id for _, chunk_id in added], removed, start)
+            if removed and vector_index.supports_removal(store.index):
+                self._tombstones.difference_update(removed)
+                self._own_index()
+                store.delete(list(removed))
+                self._positions = None
+            self._maybe_compact()
+
+    def _install_index(self, index: Any, ids: List[str], tombstones: Set[str], start: float) -> None:
+        """Swap in an index holding ids in order; tombstones are removed chunks it still holds"""
+        store = self.store
+        dead = [chunk_id for chunk_id in store.index_to_docstore_id.values() if chunk_id in self._tombstones and chunk_id not in tombstones]
+        if dead:
+            store.docstore.delete(dead)
+        store.index = index
+        store.index_to_docstore_id = dict(enumerate(ids))
+        self._positions = None
+        self._tombstones = set(tombstones)
+        self._dirty = True
+        logger.info(
+            f"Rebuilt {type(index).__name__} with {index.ntotal} vectors, dropped {len(dead)} tombstones "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    def _forget_vectors(self) -> None:
+        """Turn every embedded chunk into a lexical-only one; embed_source re-embeds them on demand"""
+        if self.store is not None:
+            for chunk_id in self.store.index_to_docstore_id.values():
+                document = self.store.docstore.search(chunk_id)
+                if chunk_id not in self._tombstones and isinstance(document, Document):
+                    self._lexical_only[chunk_id] = document
+        self.store = None
+        self._positions = None
+        self._tombstones.clear()
+        for entry in self._sources.values():
+            entry["embedded"] = False
+        self._dirty = True
+
+    def _drop_chunks(self, source: str, entry: Optional[Dict[str, Any]]) -> None:
+        """
+        Remove a source entry's chunks from the vector store or the lexical-only table, and from BM25.
+
+        Sources aliasing a removed chunk lose it and turn stale, so the next
+        request for them fetches and indexes them again.
+        """
+        if entry is None:
+            return
+        for chunk_id in entry.get("aliases", ()):
+            aliased_by = self._aliased_by.get(chunk_id)
+            if aliased_by is not None:
+                aliased_by.discard(source)
+                if not aliased_by:
+                    del self._aliased_by[chunk_id]
+        for chunk_id in entry["ids"]:
+            self._near_duplicates.remove(chunk_id)
+            for other in self._aliased_by.pop(chunk_id, ()):
+                other_entry = self._sources.get(other)
+                if other_entry is not None:
+                    other_entry["aliases"].remove(chunk_id)
+                    other_entry["indexed_at"] = 0
+        if entry.get("embedded", True):
+            self._remove_ids(entry["ids"])
+        else:
+            # Lexical-only sources may have chunks promoted by embed_selected
+            self._remove_ids([chunk_id for chunk_id in entry["ids"] if chunk_id not in self._lexical_only])
+        for chunk_id in entry["ids"]:
+            self._lexical_only.pop(chunk_id, None)
+            self.lexical.remove(chunk_id)
+
+    def _get_chunk(self, chunk_id: str) -> Optional[Document]:
+        document = self._lexical_only.get(chunk_id)
+        if document is None and self.store is not None:
+            found = self.store.docstore.search(chunk_id)
+            document = found if isinstance(found, Document) else None
+        return document
+
+    def _source_chunk_ids(self, sources: Iterable[str]) -> Set[str]:
+        """Chunk ids of sources, including the chunks of other sources they alias"""
+        chunk_ids = set()
+        for source in sources:
+            entry = self._sources.get(source, {})
+            chunk_ids.update(entry.get("ids", ()))
+            chunk_ids.update(entry.get("aliases", ()))
+        return chunk_ids
+
+    def _as_sources(self, documents: List[Document], sources: Optional[Iterable[str]]) -> List[Document]:
+        """Attribute chunks found through an alias to the requested source aliasing them"""
+        if sources is None:
+            return documents
+        wanted = set(sources)
+        attributed = []
+        for document in documents:
+            aliased_by = self._aliased_by.get(document.metadata.get("chunk_id"), set()) & wanted
+            if document.metadata.get("source") not in wanted and aliased_by:
+                document = Document(page_content=document.page_content, metadata={**document.metadata, "source": min(aliased_by)})
+            attributed.append(document)
+        return attributed
+
+    def _chunk_positions(self) -> Dict[str, int]:
+        if self._positions is None:
+            self._positions = {chunk_id: position for position, chunk_id in self.store.index_to_docstore_id.items()}
+        return self._positions
+
+    def _lexical_ranking(self, query: str, k: int, sources: Optional[Iterable[str]] = None) -> List[str]:
+        allowed = None
+        if sources is not None:
+            allowed = self._source_chunk_ids(sources)
+        return [chunk_id for chunk_id, _ in self.lexical.search(query, k=k, allowed=allowed)]
+
+    def lexical_search(self, query: str, k: int = 4, sources: Optional[Iterable[str]] = None) -> List[Document]:
+        """BM25 search over every chunk, embedded or not; no embedding call is made"""
+        with self._lock:
+            documents = (self._get_chunk(chunk_id) for chunk_id in self._lexical_ranking(query, k, sources))
+            return self._as_sources([document for document in documents if document is not None], sources)
+
+    def hybrid_search_by_vector(
+        self,
+        query: str,
+        vector: List[float],
+        k: int = 4,
+        sources: Optional[Iterable[str]] = None
+    ) -> List[Document]:
+        """Fuse dense and BM25 candidates with reciprocal rank fusion"""
+        sources = list(sources) if sources is not None else None
+        candidates = k * HYBRID_CANDIDATE_MULTIPLIER
+        with self._lock:
+            dense = self.similarity_search_by_vector(vector, k=candidates, sources=sources)
+            by_id = {document.metadata.get("chunk_id"): document for document in dense}
+            fused = lexical.reciprocal_rank_fusion([list(by_id), self._lexical_ranking(query, candidates, sources)])
+            documents = (by_id.get(chunk_id) or self._get_chunk(chunk_id) for chunk_id, _ in fused[:k])
+            return self._as_sources([document for document in documents if document is not None], sources)
+
+    async def search(
+        self,
+        query: str,
+        k: int = 4,
+        sources: Optional[Iterable[str]] = None,
+        mode: str = "dense"
+    ) -> List[Document]:
+        """Search in "dense", "lexical" or "hybrid" mode"""
+        if mode == "lexical":
+            return await executors.run_cpu(self.lexical_search, query, k=k, sources=sources)
+        if mode == "hybrid":
+            vector = await self.embeddings.aembed_query(query)
+            return await executors.run_cpu(self.hybrid_search_by_vector, query, vector, k=k, sources=sources)
+        return await self.similarity_search(query, k=k, sources=sources)
+
+    async def similarity_search(self, query: str, k: int = 4, sources: Optional[Iterable[str]] = None) -> List[Document]:
+        """Embed a query and search the corpus, optionally limited to some sources"""
+        vector = await self.embeddings.aembed_query(query)
+        return await executors.run_cpu(self.similarity_search_by_vector, vector, k=k, sources=sources)
+
+    def similarity_search_by_vector(self, vector: List[float], k: int = 4, sources: Optional[Iterable[str]] = None) -> List[Document]:
+        with self._lock:
+            if self.store is None or self.store.index.ntotal == 0:
+                return []
+            tombstones = self._tombstones
+            if sources is not None:
+                # Only the vectors of these sources are scored, however large the corpus
+                positions = self._chunk_positions()
+                selected = sorted(
+                    positions[chunk_id] for chunk_id in self._source_chunk_ids(sources)
+                    if chunk_id in positions and chunk_id not in tombstones
+                )
+                if not selected:
+                    return []
+                _, found = vector_index.search_subset(self.store.index, np.asarray([vector]), selected, k)
+                documents = (self.store.docstore.search(self.store.index_to_docstore_id[int(position)]) for position in found[0] if position >= 0)
+                return self._as_sources([document for document in documents if isinstance(document, Document)], sources)
+            if not tombstones:
+                return self.store.similarity_search_by_vector(vector, k=k)
+            total = self.store.index.ntotal
+            
+            def keep(metadata: Dict[str, Any]) -> bool:
+                return metadata.get("chunk_id") not in tombstones
+            
+            fetch_k = min(total, k * FETCH_K_MULTIPLIER)
+            while True:
+                results = self.store.similarity_search_by_vector(vector, k=k, filter=keep, fetch_k=fetch_k)
+                # Widen the candidate pool when the filter leaves too few hits
+                if len(results) >= k or fetch_k >= total:
+                    return results
+                fetch_k = min(total, fetch_k * 4)
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the FAISS index, docstore and source table to a directory"""
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given for saving the corpus")
+        with self._save_lock:
+            # Searches wait for the shallow copies only; the index is serialized and written outside
+            # the lock, and changes made meanwhile go to a copy of it (see _own_index)
+            with self._lock:
+                index = docstore = None
+                if self.store is not None:
+                    index = self._saving_index = self.store.index
+                    index_to_docstore_id = dict(self.store.index_to_docstore_id)
+                    docstore = InMemoryDocstore({
+                        chunk_id: self.store.docstore.search(chunk_id) for chunk_id in index_to_docstore_id.values()
+                    })
+                sources = {
+                    source: {key: list(value) if isinstance(value, list) else value for key, value in entry.items()}
+                    for source, entry in self._sources.items()
+                }
+                index_state = {"spec": self.index_spec, "tombstones": sorted(self._tombstones), "embedding": self.embedding_id}
+                lexical_only = dict(self._lexical_only)
+                self._dirty = False
+                self._saved_at = time.time()
+            try:
+                os.makedirs(path, exist_ok=True)
+                if index is not None:
+                    # The files FAISS.save_local writes, so FAISS.load_local reads them
+                    self._replace_file(path, "index.faiss", vector_index.serialize(index))
+                    self._replace_file(path, "index.pkl", pickle.dumps((docstore, index_to_docstore_id)))
+                else:
+                    # Do not leave a previous save's vectors behind to be loaded later
+                    for name in ("index.faiss", "index.pkl"):
+                        if os.path.exists(os.path.join(path, name)):
+                            os.remove(os.path.join(path, name))
+                self._replace_file(path, "sources.json", json.dumps(sources).encode("utf-8"))
+                self._replace_file(path, "index.json", json.dumps(index_state).encode("utf-8"))
+                self._replace_file(path, "lexical_only.json", json.dumps({
+                    chunk_id: {"text": document.page_content, "metadata": document.metadata}
+                    for chunk_id, document in lexical_only.items()
+                }).encode("utf-8"))
+            except Exception:
+                self._dirty = True
+                raise
+            finally:
+                with self._lock:
+                    self._saving_index = None
+        logger.info(f"Saved corpus with {sum(len(entry['ids']) for entry in sources.values())} chunks from {len(sources)} sources to {path}")
+
+    @staticmethod
+    def _replace_file(path: str, name: str, data: Any) -> None:
+        """Write a file next to its target and swap it in, so readers never see it half written"""
+        target = os.path.join(path, name)
+        with open(target + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(target + ".tmp", target)
+
+    def maybe_save(self, interval: float = CORPUS_SAVE_INTERVAL) -> None:
+        """Save the corpus if it changed and the last save is older than interval"""
+        if self.path and self._dirty and time.time() - self._saved_at >= interval:
+            self.save()
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embeddings: Optional[Embeddings] = None,
+        index_spec: Optional[str] = None,
+        embedding_id: Optional[str] = None
+    ) -> "VectorCorpus":
+        """Load a corpus saved with save(), or return an empty one bound to path"""
+        corpus = cls(embeddings=embeddings, path=path, index_spec=index_spec, embedding_id=embedding_id)
+        sources_path = os.path.join(path, "sources.json")
+        if not os.path.exists(sources_path):
+            return corpus
+        with open(sources_path) as f:
+            corpus._sources = json.load(f)
+        if os.path.exists(os.path.join(path, "index.faiss")):
+            # The pickle is only ever written by save() above
+            corpus.store = FAISS.load_local(path, corpus.embeddings, allow_dangerous_deserialization=True)
+            vector_index.tune(corpus.store.index)
+            saved_spec = "flat"
+            saved_embedding = corpus.embedding_id
+            index_state_path = os.path.join(path, "index.json")
+            if os.path.exists(index_state_path):
+                with open(index_state_path) as f:
+                    index_state = json.load(f)
+                saved_spec = index_state["spec"]
+                corpus._tombstones = set(index_state["tombstones"])
+                saved_embedding = index_state.get("embedding", saved_embedding)
+            if saved_embedding != corpus.embedding_id:
+                # Vectors from another model are meaningless to this one; keep the texts, drop the vectors
+                logger.info(f"Corpus was embedded with {saved_embedding}, re-embedding with {corpus.embedding_id} on demand")
+                corpus._forget_vectors()
+            elif saved_spec != corpus.index_spec:
+                logger.info(f"Corpus index was saved as {saved_spec}, rebuilding it as {corpus.index_spec}")
+                corpus._rebuild_index()
+        lexical_path = os.path.join(path, "lexical_only.json")
+        if os.path.exists(lexical_path):
+            with open(lexical_path) as f:
+                corpus._lexical_only.update({
+                    chunk_id: Document(page_content=item["text"], metadata=item["metadata"])
+                    for chunk_id, item in json.load(f).items()
+                })
+        # The BM25 index and the near-duplicate maps are rebuilt from the stored chunks
+        for source, entry in corpus._sources.items():
+            corpus._register_chunks(source, entry)
+            for chunk_id in entry["ids"]:
+                document = corpus._get_chunk(chunk_id)
+                if document is not None:
+                    corpus.lexical.add(chunk_id, document.page_content)
+        logger.info(f"Loaded corpus with {len(corpus)} chunks from {len(corpus._sources)} sources")
+        return corpus
+
+def _to_json(document: Document) -> Dict[str, Any]:
+    return {"text": document.page_content, "metadata": document.metadata}
+
+def _from_json(item: Dict[str, Any]) -> Document:
+    return Document(page_content=item["text"], metadata=item["metadata"])
+
+class RemoteCorpus:
+    """
+    The corpus of the writer worker, used by the other workers.py workers.
+
+    Offers the VectorCorpus methods update_corpus, index_urls and the MCP
+    tools call, each forwarded to the writer's /corpus/<operation> route
+    (see serve_corpus_call). Pages are fetched and chunked by the worker
+    serving the request; embedding, indexing and searching happen in the
+    writer, so the vectors, texts and BM25 postings are held once.
+    """
+
+    def __init__(self, url: str = CORPUS_WRITER_URL, timeout: float = CORPUS_WRITER_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    async def _call(self, operation: str, **payload: Any) -> Any:
+        # Calls stay on localhost, a session per call costs less than tracking one per event loop
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            async with session.post(f"{self.url}/corpus/{operation}", json=payload) as response:
+                body = await response.json()
+                if response.status != 200:
+                    raise RuntimeError(f"Corpus writer failed {operation}: {body.get('error')}")
+                return body["result"]
+
+    async def plan_update(self, links: List[str], embed: bool = True, chunking_key: Optional[str] = None) -> Tuple[List[str], List[str]]:
+        stale_links, lexical_links = await self._call("plan_update", links=links, embed=embed, chunking_key=chunking_key)
+        return stale_links, lexical_links
+
+    async def finish_update(self, keep: Iterable[str] = ()) -> int:
+        return await self._call("finish_update", keep=list(keep))
+
+    async def add_documents(self, documents: List[Document], embed: bool = True) -> int:
+        return await self._call("add_documents", documents=[_to_json(document) for document in documents], embed=embed)
+
+    async def embed_source(self, source: str) -> int:
+        return await self._call("embed_source", source=source)
+
+    async def embed_selected(self, query: str, sources: Iterable[str]) -> int:
+        return await self._call("embed_selected", query=query, sources=list(sources))
+
+    async def search(self, query: str, k: int = 4, sources: Optional[Iterable[str]] = None, mode: str = "dense") -> List[Document]:
+        found = await self._call("search", query=query, k=k, sources=list(sources) if sources is not None else None, mode=mode)
+        return [_from_json(item) for item in found]
+
+async def serve_corpus_call(corpus: VectorCorpus, operation: str, payload: Dict[str, Any]) -> Any:
+    """Run a RemoteCorpus call on the writer's corpus; returns a JSON-serializable result"""
+    if operation == "plan_update":
+        return await corpus.plan_update(payload["links"], payload["embed"], payload["chunking_key"])
+    if operation == "finish_update":
+        return await corpus.finish_update(payload["keep"])
+    if operation == "add_documents":
+        return await corpus.add_documents([_from_json(item) for item in payload["documents"]], embed=payload["embed"])
+    if operation == "embed_source":
+        return await corpus.embed_source(payload["source"])
+    if operation == "embed_selected":
+        return await corpus.embed_selected(payload["query"], payload["sources"])
+    if operation == "search":
+        found = await corpus.search(payload["query"], k=payload["k"], sources=payload["sources"], mode=payload["mode"])
+        return [_to_json(document) for document in found]
+    raise KeyError(f"Unknown corpus operation '{operation}'")
+
+Corpus = Union[VectorCorpus, RemoteCorpus]
+
+_corpus: Optional[Corpus] = None
+
+def get_corpus() -> Corpus:
+    """Return the shared corpus, loading it from CORPUS_DIR on first use (or the writer's, with CORPUS_WRITER_URL)"""
+    global _corpus
+    if _corpus is None:
+        _corpus = RemoteCorpus(CORPUS_WRITER_URL) if CORPUS_WRITER_URL else VectorCorpus.load(CORPUS_DIR)
+    return _corpus
+
 async def create_rag_from_documents(documents: List[Document]) -> FAISS:
     """
     Create a RAG system directly from a list of documents
@@ -22,100 +926,238 @@ async def create_rag_from_documents(documents: List[Document]) -> FAISS:
     Returns:
         FAISS: Vector store object
     """
-    max_retries = 3
-    retry_delay = 2  # seconds
+    # Ollama calls retry with backoff behind a circuit breaker (resilience.py); in-process providers need neither
+    try:
+        logger.info(f"Creating RAG from {len(documents)} documents")
+        embeddings = get_embeddings()
+        
+        # Text chunking processing
+        logger.info("Splitting documents into chunks")
+        chunks = await prepare_chunks(documents)
+        logger.info(f"Created {len(chunks)} chunks")
+        
+        logger.info("Creating vector store")
+        corpus = VectorCorpus(embeddings=embeddings)
+        await corpus.add_documents(chunks)
+        if corpus.store is None:
+            # Empty pages, or every chunk dropped as boilerplate or a duplicate
+            raise ValueError("No chunks to index in the given documents")
+        logger.info("Vector store created successfully")
+        return corpus.store
+        
+    except Exception as e:
+        logger.error(f"Failed to create RAG from documents: {str(e)}")
+        raise
+
+async def index_urls(
+    links: List[str],
+    corpus: Corpus,
+    on_page_indexed: Optional[Callable[[str], Awaitable[None]]] = None,
+    deadline: Optional[float] = None,
+    on_page_dropped: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    embed: bool = True,
+    chunking_config: Optional[chunking.ChunkingConfig] = None
+) -> int:
+    """
+    Stream pages into a corpus as they arrive.
     
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Attempt {attempt + 1}: Creating RAG from {len(documents)} documents")
-            embeddings = OllamaEmbeddings(
-                model="mxbai-embed-large:latest",
-                base_url="http://localhost:11434"
-            )
-            
-            # Text chunking processing
-            logger.info("Splitting documents into chunks")
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=2000,
-                chunk_overlap=200,
-                length_function=len,
+    All fetches run concurrently; every page that completes is handed over a
+    bounded queue to embed workers that split and upsert it while the other
+    fetches are still in flight, so the slowest site no longer delays the
+    embedding of the others. Domain boilerplate and chunks near-duplicating
+    a chunk from another page are dropped before embedding (dedup.py); the
+    page keeps the other page's chunk as an alias, so searches limited to it
+    still find that text.
+    
+    With a deadline, fetches still running when DEADLINE_INDEX_RESERVE of the
+    remaining budget is left are cancelled, and pages not indexed by the
+    deadline itself are abandoned; the corpus keeps whatever was indexed.
+    
+    Args:
+        links: URLs to fetch and index
+        corpus: Corpus receiving the chunks
+        on_page_indexed: Optional coroutine called with each indexed source URL
+        deadline: Optional time.monotonic() deadline for fetching and indexing
+        on_page_dropped: Optional coroutine called with each source URL that
+            was not indexed and the reason ("no_content", "index_failed" or
+            "deadline")
+        embed: Embed the chunks; when False they only go into the BM25 index
+        chunking_config: Chunking settings (default chunking.DEFAULT_CONFIG)
+        
+    Returns:
+        int: Number of pages indexed (including unchanged ones)
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    indexed = 0
+    errors: List[Exception] = []
+    # Sources handed to the embed workers and not finished yet
+    queued: Set[str] = set()
+    async def drop(source: str, reason: str) -> None:
+        logger.warning(f"Dropped {source}: {reason}")
+        if on_page_dropped:
+            await on_page_dropped(source, reason)
+    
+    async def embed_worker():
+        nonlocal indexed
+        while True:
+            documents = await queue.get()
+            source = documents[0].metadata.get("source")
+            try:
+                chunks = await prepare_chunks(documents, chunking_config)
+                await corpus.add_documents(chunks, embed=embed)
+                indexed += 1
+                if on_page_indexed:
+                    await on_page_indexed(source)
+            except Exception as e:
+                logger.error(f"Failed to index {source}: {str(e)}")
+                errors.append(e)
+                await drop(source, "index_failed")
+            finally:
+                queued.discard(source)
+                queue.task_done()
+    
+    fetch_cutoff = None
+    if deadline is not None:
+        fetch_cutoff = deadline - resilience.time_left(deadline) * DEADLINE_INDEX_RESERVE
+    
+    workers = [asyncio.create_task(embed_worker()) for _ in range(PIPELINE_EMBED_WORKERS)]
+    fetches = {asyncio.ensure_future(search.fetch_page(url)): url for url in links}
+    try:
+        pending = set(fetches)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=resilience.time_left(fetch_cutoff),
+                return_when=asyncio.FIRST_COMPLETED
             )
-            split_documents = text_splitter.split_documents(documents)
-            logger.info(f"Created {len(split_documents)} chunks")
-            
-            logger.info("Creating vector store")
-            vectorstore = FAISS.from_documents(documents=split_documents, embedding=embeddings)
-            logger.info("Vector store created successfully")
-            return vectorstore
-            
-        except Exception as e:
-            logger.error(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                logger.error("All attempts failed to create RAG from documents")
-                raise
+            if not done:
+                logger.warning(f"Fetch deadline reached with {len(pending)} pages outstanding")
+                break
+            for fetch in done:
+                url = fetches[fetch]
+                try:
+                    documents = fetch.result()
+                except Exception as e:
+                    logger.error(f"Fetch failed: {str(e)}")
+                    documents = []
+                if not documents:
+                    await drop(url, "no_content")
+                    continue
+                queued.add(documents[0].metadata.get("source"))
+                try:
+                    await asyncio.wait_for(queue.put(documents), resilience.time_left(deadline))
+                except asyncio.TimeoutError:
+                    queued.discard(documents[0].metadata.get("source"))
+                    await drop(url, "deadline")
+        for fetch in pending:
+            fetch.cancel()
+            await drop(fetches[fetch], "deadline")
+        try:
+            await asyncio.wait_for(queue.join(), resilience.time_left(deadline))
+        except asyncio.TimeoutError:
+            logger.warning(f"Indexing deadline reached with {len(queued)} pages outstanding")
+            for source in sorted(queued):
+                await drop(source, "deadline")
+    finally:
+        for fetch in fetches:
+            fetch.cancel()
+        for worker in workers:
+            worker.cancel()
+    
+    logger.info(f"Indexed {indexed} of {len(links)} pages")
+    if errors and not indexed:
+        raise errors[0]
+    return indexed
 
 async def create_rag(links: List[str]) -> FAISS:
     """Create a RAG system from a list of URLs"""
     try:
         logger.info(f"Creating RAG from {len(links)} URLs")
-        # Use Ollama embeddings instead of OpenAI
-        embeddings = OllamaEmbeddings(
-            model="mxbai-embed-large:latest",
-            base_url="http://localhost:11434"
-        )
+        # Throwaway corpus on the shared embeddings of the configured provider
+        corpus = VectorCorpus(embeddings=get_embeddings())
+        await index_urls(links, corpus)
         
-        # Process URLs in parallel
-        logger.info("Processing URLs in parallel")
-        tasks = [search.get_web_content(url) for url in links]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        documents = []
-        for result in results:
-            if isinstance(result, List) and result:
-                documents.extend(result)
-        
-        logger.info(f"Retrieved {len(documents)} valid documents")
-        
-        if not documents:
+        if corpus.store is None:
             logger.error("No valid documents retrieved from URLs")
             raise ValueError("No valid documents retrieved from URLs")
-            
-        logger.info("Splitting documents into chunks")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        split_documents = text_splitter.split_documents(documents)
-        logger.info(f"Created {len(split_documents)} chunks")
         
-        logger.info("Creating vector store")
-        vectorstore = FAISS.from_documents(documents=split_documents, embedding=embeddings)
-        logger.info("Vector store created successfully")
-        return vectorstore
+        logger.info(f"Vector store created successfully with {len(corpus)} chunks")
+        return corpus.store
     except Exception as e:
         logger.error(f"Error in create_rag: {str(e)}")
         raise
 
-async def search_rag(query: str, vectorstore: FAISS, k: int = 5) -> List[Document]:
-    """Search the RAG system for relevant documents"""
-    max_retries = 3
-    retry_delay = 2  # seconds
-    
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Searching RAG with query: {query}")
-            results = vectorstore.similarity_search(query, k=k)
-            logger.info(f"Found {len(results)} relevant documents")
-            return results
-        except Exception as e:
-            logger.error(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+async def update_corpus(
+    links: List[str],
+    corpus: Optional[Corpus] = None,
+    on_page_indexed: Optional[Callable[[str], Awaitable[None]]] = None,
+    deadline: Optional[float] = None,
+    on_page_dropped: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    embed: bool = True,
+    chunking_config: Optional[chunking.ChunkingConfig] = None
+) -> Corpus:
+    """Upsert the pages behind a list of URLs into the persistent corpus (BM25 only if embed is False)"""
+    try:
+        corpus = corpus or get_corpus()
+        # Sources chunked with other settings are re-split from the (cached) page
+        chunking_key = (chunking_config or chunking.DEFAULT_CONFIG).key()
+        # Fresh lexical-only sources only need embedding, not another download
+        stale_links, lexical_links = await corpus.plan_update(links, embed, chunking_key)
+        logger.info(f"{len(links) - len(stale_links) - len(lexical_links)} of {len(links)} URLs already indexed")
+        if not stale_links and not lexical_links:
+            return corpus
+        
+        for position, link in enumerate(lexical_links):
+            try:
+                await asyncio.wait_for(corpus.embed_source(link), resilience.time_left(deadline))
+            except asyncio.TimeoutError:
+                # Still searchable through BM25, embedded by a later request
+                logger.warning(f"Deadline reached embedding {len(lexical_links) - position} lexical-only sources")
+                for skipped in lexical_links[position:]:
+                    if on_page_dropped:
+                        await on_page_dropped(skipped, "deadline")
+                break
+            if on_page_indexed:
+                await on_page_indexed(link)
+        
+        logger.info("Streaming URLs into the corpus")
+        await index_urls(
+            stale_links,
+            corpus,
+            on_page_indexed=on_page_indexed,
+            deadline=deadline,
+            on_page_dropped=on_page_dropped,
+            embed=embed,
+            chunking_config=chunking_config
+        )
+        # The sources just requested are the last to go
+        chunk_count = await corpus.finish_update(keep=links)
+        logger.info(f"Corpus holds {chunk_count} chunks")
+        return corpus
+    except Exception as e:
+        logger.error(f"Error in update_corpus: {str(e)}")
+        raise
+
+async def search_rag(
+    query: str,
+    vectorstore: Union[FAISS, Corpus],
+    k: int = 5,
+    sources: Optional[List[str]] = None,
+    mode: str = "dense"
+) -> List[Document]:
+    """Search the RAG system for relevant documents (mode: dense, lexical or hybrid)"""
+    try:
+        logger.info(f"Searching RAG with query: {query} (mode: {mode})")
+        with metrics.stage("retrieve"):
+            if isinstance(vectorstore, (VectorCorpus, RemoteCorpus)):
+                results = await vectorstore.search(query, k=k, sources=sources, mode=mode)
             else:
-                logger.error("All attempts failed to search RAG")
-                raise
+                if mode != "dense":
+                    logger.warning(f"Plain FAISS stores only support dense search, ignoring mode '{mode}'")
+                vector = await vectorstore.embeddings.aembed_query(query)
+                results = await executors.run_cpu(vectorstore.similarity_search_by_vector, vector, k=k)
+        logger.info(f"Found {len(results)} relevant documents")
+        return results
+    except Exception as e:
+        logger.error(f"Failed to search RAG: {str(e)}")
+        raise
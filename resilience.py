@@ -0,0 +1,246 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+import httpx
+import requests
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))  # total attempts per call, including the first
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))  # seconds
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))  # seconds
+# Retries may add at most this fraction of extra load, plus a small floor for idle periods
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("RETRY_BUDGET_MIN_PER_SEC", "1"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # consecutive failures
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # seconds open before a trial call
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+# Errors a retry can fix; the HTTP client libraries' transport errors are not builtin ConnectionErrors
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError, httpx.TransportError, requests.ConnectionError, requests.Timeout)
+# exa_py reports HTTP errors as ValueError("Request failed with status code 429: ...")
+STATUS_IN_MESSAGE = re.compile(r"status code:? (\d{3})")
+
+retries_total: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_dependency_retries_total", "Retried calls to an external dependency", ["dependency"]
+))
+failures_total: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_dependency_failures_total", "Failed calls to an external dependency, by reason", ["dependency", "reason"]
+))
+breaker_state: metrics.Gauge = metrics.registry.register(metrics.Gauge(
+    "rag_circuit_open", "1 while the dependency's circuit breaker is open or half-open", ["dependency"]
+))
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until a time.monotonic() deadline (never negative), or None without one."""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, dependency: str, retry_after: float):
+        super().__init__(f"{dependency} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status code carried by a client library error, if any."""
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status is None:
+        match = STATUS_IN_MESSAGE.search(str(error))
+        status = int(match.group(1)) if match else None
+    return status if isinstance(status, int) and status > 0 else None
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a retry may succeed: timeouts, connection errors, HTTP 429 and 5xx."""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the given retry (0 = first retry)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the breaker opens and calls
+    fail immediately. Once reset_timeout has passed, a single trial call is
+    let through (half-open); its success closes the breaker, its failure
+    opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self.state == OPEN and elapsed >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_running = False
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                logger.info(f"Circuit for {self.name} half-open, sending a trial call")
+                return
+            raise CircuitOpenError(self.name, max(self.reset_timeout - elapsed, 0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+                breaker_state.inc(-1, dependency=self.name)
+            self.state = CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def release_trial(self) -> None:
+        """Let another trial call through after one was cancelled before finishing."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    breaker_state.inc(dependency=self.name)
+                    logger.warning(f"Circuit for {self.name} opened after {self._failures} consecutive failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of first attempts.
+
+    Every first attempt deposits `ratio` tokens and a retry spends one, so
+    under a backend outage retries add at most ratio extra load instead of
+    multiplying it. The bucket also refills at min_per_sec so a lightly
+    loaded server can still retry.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC, max_tokens: float = 20):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._refilled_at) * self.min_per_sec)
+        self._refilled_at = now
+
+    def record_attempt(self) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take a token for a retry; False when the budget is exhausted."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+class Dependency:
+    """Retry policy, circuit breaker and retry budget for one external backend."""
+
+    def __init__(
+        self,
+        name: str,
+        attempts: int = RETRY_ATTEMPTS,
+        retryable: Callable[[BaseException], bool] = is_transient,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None
+    ):
+        self.name = name
+        self.attempts = max(attempts, 1)
+        self.retryable = retryable
+        self.breaker = breaker or CircuitBreaker(name)
+        self.budget = budget or RetryBudget()
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """
+        Await func(*args, **kwargs) with backoff retries, failing fast while the circuit is open.
+
+        Only errors the retryable predicate accepts are retried and count
+        toward the circuit breaker; others (e.g. HTTP 400 for bad input, a
+        bad API key) say nothing about the backend's health and are raised
+        at once.
+        """
+        self.budget.record_attempt()
+        for attempt in range(self.attempts):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                failures_total.inc(dependency=self.name, reason="circuit_open")
+                raise
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                if not self.retryable(e):
+                    # The backend answered; a half-open breaker may send another trial call
+                    self.breaker.release_trial()
+                    failures_total.inc(dependency=self.name, reason="not_retryable")
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.attempts - 1:
+                    failures_total.inc(dependency=self.name, reason="attempts_exhausted")
+                    raise
+                if not self.budget.try_spend():
+                    failures_total.inc(dependency=self.name, reason="retry_budget")
+                    logger.warning(f"Retry budget for {self.name} exhausted, not retrying: {str(e)}")
+                    raise
+                delay = backoff_delay(attempt)
+                retries_total.inc(dependency=self.name)
+                logger.warning(f"{self.name} call failed (attempt {attempt + 1}/{self.attempts}), retrying in {delay:.2f}s: {str(e)}")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+_dependencies: Dict[str, Dependency] = {}
+
+def get_dependency(name: str) -> Dependency:
+    """Return the shared resilience policy for a backend (e.g. "ollama", "exa")."""
+    if name not in _dependencies:
+        _dependencies[name] = Dependency(name)
+    return _dependencies[name]
+
+async def call(name: str, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+    """Call a backend through its shared retry policy and circuit breaker."""
+    return await get_dependency(name).call(func, *args, **kwargs)
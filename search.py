@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from langchain_core.documents import Document
 from exa_py import Exa
 import asyncio
@@ -7,11 +7,17 @@ from dotenv import load_dotenv
 import aiohttp
 import ssl
 import certifi
-import requests
-from bs4 import BeautifulSoup
 import time
+import codecs
+import json
 import logging
+import re
 import streamlit as st
+import cache
+import executors
+import extractors
+import metrics
+import resilience
 
 # Load .env variables with override
 load_dotenv(override=True)
@@ -28,60 +34,231 @@ ssl_context = ssl.create_default_context(cafile=certifi.where())
 
 # Constants
 MAX_RETRIES = 3
-REQUEST_TIMEOUT = 30
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 
+# Fetch engine settings (shared connection pool and per-stage timeouts)
+MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "100"))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("FETCH_MAX_CONNECTIONS_PER_HOST", "8"))
+KEEPALIVE_TIMEOUT = float(os.getenv("FETCH_KEEPALIVE_TIMEOUT", "30"))
+DNS_CACHE_TTL = int(os.getenv("FETCH_DNS_CACHE_TTL", "300"))
+TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "10"))
+
+# Download limits: bodies are streamed and cut off at FETCH_MAX_BYTES
+MAX_PAGE_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+TEXT_CONTENT_TYPES = {"text/html", "application/xhtml+xml", "text/plain"}
+# Leading bytes of common binary formats served with a missing or wrong Content-Type
+BINARY_SIGNATURES = (b"%PDF", b"\x89PNG", b"GIF8", b"\xff\xd8\xff", b"PK\x03\x04", b"\x1f\x8b", b"RIFF", b"\x00\x00\x00")
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+
+# Exa response cache
+EXA_CACHE_TTL = float(os.getenv("EXA_CACHE_TTL", "300"))
+EXA_CACHE_MAX_ENTRIES = int(os.getenv("EXA_CACHE_MAX_ENTRIES", "1000"))
+SUMMARY_OPTIONS = {"query": "Main points and key takeaways"}
+
+# Hedged fetches: a duplicate request for pages still loading after this many seconds (0 = off)
+FETCH_HEDGE_AFTER = float(os.getenv("FETCH_HEDGE_AFTER", "0"))
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-async def get_web_content(url: str) -> List[Document]:
-    """Get web content using requests and BeautifulSoup as fallback."""
+# Identical searches within the TTL, or in flight at the same time, share one Exa call
+exa_cache = cache.TTLCache(ttl=EXA_CACHE_TTL, max_entries=EXA_CACHE_MAX_ENTRIES)
+exa_flights = cache.SingleFlight()
+
+hedged_fetches: metrics.Counter = metrics.registry.register(metrics.Counter(
+    "rag_hedged_fetches_total", "Hedged page fetches by the request that answered first", ["winner"]
+))
+
+# Shared HTTP sessions, one per event loop (a session cannot be used across loops)
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+_session_closers: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+def build_timeout(
+    total: float = TOTAL_TIMEOUT,
+    connect: float = CONNECT_TIMEOUT,
+    read: float = READ_TIMEOUT
+) -> aiohttp.ClientTimeout:
+    """Build an aiohttp timeout with total, connect and per-read limits."""
+    return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+async def _close_with_loop(session: aiohttp.ClientSession) -> None:
+    """Close a session when its event loop shuts down (asyncio.run cancels leftover tasks before closing it)."""
+    loop = asyncio.get_running_loop()
     try:
-        logger.info(f"Fetching content from URL: {url}")
-        headers = {
-            "User-Agent": USER_AGENT
-        }
-        
+        await loop.create_future()
+    finally:
+        if _sessions.get(loop) is session:
+            del _sessions[loop]
+        if _session_closers.get(loop) is asyncio.current_task():
+            del _session_closers[loop]
+        if not session.closed:
+            await session.close()
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    for other in [other for other in _sessions if other.is_closed()]:
+        # Loop closed without cancelling its tasks; its connections died with it
+        await _sessions.pop(other).close()
+        _session_closers.pop(other, None)
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context,
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        )
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=connector,
+            timeout=build_timeout(),
+            headers={"User-Agent": USER_AGENT},
+        )
+        # e.g. one asyncio.run per query: close the session with its loop instead of leaking its connector
+        closer = _session_closers.pop(loop, None)
+        if closer is not None:
+            closer.cancel()
+        _session_closers[loop] = loop.create_task(_close_with_loop(session))
+        logger.info(
+            f"Created HTTP session (pool size: {MAX_CONNECTIONS}, per host: {MAX_CONNECTIONS_PER_HOST})"
+        )
+    return session
+
+async def close_session() -> None:
+    """Close the shared aiohttp session of the running event loop if it is open."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    closer = _session_closers.pop(loop, None)
+    if closer is not None:
+        closer.cancel()
+    if session is not None and not session.closed:
+        await session.close()
+        logger.info("Closed HTTP session")
+
+def _page_document(url: str, content: str) -> List[Document]:
+    """Wrap extracted page text in the Document format used by the RAG pipeline."""
+    return [Document(
+        page_content=content,
+        metadata={"source": url, "length": len(content)}
+    )]
+
+def sniff_content_type(content_type: str, head: bytes) -> Optional[str]:
+    """Return the text content type to parse, or None for binaries."""
+    if any(head.startswith(signature) for signature in BINARY_SIGNATURES):
+        return None
+    if content_type in TEXT_CONTENT_TYPES:
+        return content_type
+    if content_type in ("", "application/octet-stream"):
+        lowered = head[:512].lstrip().lower()
+        if lowered.startswith((b"<!doctype html", b"<html")) or b"<head" in lowered or b"<body" in lowered:
+            return "text/html"
+    return None
+
+def resolve_encoding(charset: Optional[str], head: bytes) -> str:
+    """Pick the body encoding from the header, then a <meta> charset, then UTF-8 (no detection)."""
+    candidates = [charset]
+    match = META_CHARSET.search(head[:4096])
+    if match:
+        candidates.append(match.group(1).decode("ascii", "ignore"))
+    for candidate in candidates:
+        if not candidate:
+            continue
         try:
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"HTTP Error for {url}: {e.response.status_code} - {e.response.reason}")
-            return []
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"Connection Error for {url}: {str(e)}")
-            return []
-        except requests.exceptions.Timeout as e:
-            logger.error(f"Timeout Error for {url}: {str(e)}")
-            return []
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request Error for {url}: {str(e)}")
-            return []
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+async def read_capped(
+    response: aiohttp.ClientResponse,
+    max_bytes: int = MAX_PAGE_BYTES,
+    head: bytes = b""
+) -> Tuple[bytearray, bool]:
+    """Stream a response body (after the already read head) into one buffer, stopping at max_bytes."""
+    body = bytearray(head[:max_bytes])
+    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+        body.extend(chunk[:max_bytes - len(body)])
+        if len(body) >= max_bytes:
+            # Drop the connection instead of draining the rest of the body
+            response.close()
+            return body, True
+    return body, False
+
+async def get_web_content(url: str, timeout: Optional[aiohttp.ClientTimeout] = None) -> List[Document]:
+    """Get web content using the shared aiohttp session and the configured HTML extractor."""
+    try:
+        page_cache = cache.get_page_cache()
+        cached = await executors.run_io(page_cache.get, url) if page_cache else None
+        if cached and cached.is_fresh(page_cache.ttl):
+            logger.info(f"Page cache hit for {url}")
+            metrics.record_cache("page", "hit")
+            return _page_document(url, cached.content)
         
-        # Parse the HTML content
-        logger.info(f"Parsing HTML content from {url}")
-        soup = BeautifulSoup(response.text, 'html.parser')
+        if page_cache:
+            metrics.record_cache("page", "stale" if cached else "miss")
+        logger.info(f"Fetching content from URL: {url}")
+        session = await get_session()
         
-        # Remove script and style elements
-        script_count = len(soup(["script", "style"]))
-        for script in soup(["script", "style"]):
-            script.decompose()
-        logger.debug(f"Removed {script_count} script/style elements from {url}")
-            
-        # Get text content
-        text = soup.get_text(separator='\n', strip=True)
+        # Revalidate stale entries with a conditional GET
+        headers = {}
+        if cached:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
         
-        # Basic text cleaning
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        content = '\n'.join(lines)
+        with metrics.stage("fetch"), metrics.in_flight.track(kind="fetch"):
+            try:
+                async with session.get(url, headers=headers, timeout=timeout or build_timeout()) as response:
+                    if response.status == 304 and cached:
+                        logger.info(f"Page not modified, reusing cached content for {url}")
+                        metrics.record_cache("page", "revalidated")
+                        await executors.run_io(page_cache.touch, url)
+                        return _page_document(url, cached.content)
+                    response.raise_for_status()
+                    if (response.content_length or 0) > MAX_PAGE_BYTES:
+                        logger.info(f"{url} declares {response.content_length} bytes, reading the first {MAX_PAGE_BYTES}")
+                    head = await response.content.read(DOWNLOAD_CHUNK_BYTES)
+                    content_type = sniff_content_type(response.content_type, head)
+                    if content_type is None:
+                        logger.info(f"Skipping {url}: unsupported content type '{response.content_type}'")
+                        response.close()
+                        return []
+                    body, truncated = await read_capped(response, MAX_PAGE_BYTES, head)
+                    encoding = resolve_encoding(response.charset, head)
+                    logger.info(
+                        f"Downloaded {len(body)} bytes from {url} ({content_type}, {encoding}"
+                        f"{', truncated at cap' if truncated else ''}; cap {MAX_PAGE_BYTES} bytes)"
+                    )
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+            except aiohttp.ClientResponseError as e:
+                logger.error(f"HTTP Error for {url}: {e.status} - {e.message}")
+                return []
+            except asyncio.TimeoutError as e:
+                logger.error(f"Timeout Error for {url}: {str(e)}")
+                return []
+            except aiohttp.ClientConnectionError as e:
+                logger.error(f"Connection Error for {url}: {str(e)}")
+                return []
+            except aiohttp.ClientError as e:
+                logger.error(f"Request Error for {url}: {str(e)}")
+                return []
+        
+        # Parse the HTML content in the process pool (small pages stay in-process)
+        logger.info(f"Parsing HTML content from {url}")
+        with metrics.stage("parse"):
+            content = await executors.process_stage.run(extractors.extract_buffer, body, encoding, content_type)
         
         if content:
-            content_length = len(content)
-            logger.info(f"Successfully extracted {content_length} characters from {url}")
-            return [Document(
-                page_content=content,
-                metadata={"source": url, "length": content_length}
-            )]
+            logger.info(f"Successfully extracted {len(content)} characters from {url}")
+            if page_cache:
+                await executors.run_io(page_cache.put, url, content, etag=etag, last_modified=last_modified)
+            return _page_document(url, content)
         
         logger.warning(f"No content extracted from {url}")
         return []
@@ -90,6 +267,38 @@ async def get_web_content(url: str) -> List[Document]:
         logger.error(f"Unexpected error for {url}: {str(e)}", exc_info=True)
         return []
 
+async def fetch_page(url: str, hedge_after: Optional[float] = None) -> List[Document]:
+    """
+    Fetch a page, hedging slow hosts with a duplicate request.
+    
+    When the first request has not finished after hedge_after seconds, a
+    second one is sent; the first non-empty result wins and the other
+    request is cancelled.
+    """
+    hedge_after = FETCH_HEDGE_AFTER if hedge_after is None else hedge_after
+    if hedge_after <= 0:
+        return await get_web_content(url)
+    primary = asyncio.ensure_future(get_web_content(url))
+    attempts = {primary}
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+        if done:
+            return primary.result()
+        logger.info(f"No response from {url} after {hedge_after}s, sending a hedged request")
+        attempts.add(asyncio.ensure_future(get_web_content(url)))
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                documents = attempt.result()
+                if documents:
+                    hedged_fetches.inc(winner="primary" if attempt is primary else "hedge")
+                    return documents
+        return []
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
 async def search_and_get_content(query: str, num_results: int = 10) -> Tuple[str, List[Document]]:
     """Combined function to search web and get content."""
     try:
@@ -126,15 +335,37 @@ async def search_and_get_content(query: str, num_results: int = 10) -> Tuple[str
         logger.error(f"Error in search_and_get_content: {str(e)}")
         return "Error occurred during search and content retrieval", []
 
-async def search_web(query: str, num_results: int = 5) -> Tuple[str, list]:
-    """Search the web using Exa API."""
-    try:
-        logger.info(f"Searching web with Exa API. Query: {query}, Results: {num_results}")
-        search_results = exa.search_and_contents(
+async def search_exa(query: str, num_results: int, summary: Optional[dict] = None) -> Any:
+    """Run an Exa search with contents, served from the TTL cache when possible."""
+    summary = summary or SUMMARY_OPTIONS
+    key = (query, num_results, json.dumps(summary, sort_keys=True))
+    cached = exa_cache.get(key)
+    if cached is not None:
+        logger.info(f"Exa cache hit for query: {query}")
+        metrics.record_cache("exa", "hit")
+        return cached
+    metrics.record_cache("exa", "miss")
+    
+    async def fetch():
+        response = await resilience.call(
+            "exa",
+            executors.run_io,
+            exa.search_and_contents,
             query,
             num_results=num_results,
-            summary={"query": "Main points and key takeaways"}
+            summary=summary
         )
+        exa_cache.set(key, response)
+        return response
+    
+    return await exa_flights.do(key, fetch)
+
+async def search_web(query: str, num_results: int = 5, deadline: Optional[float] = None) -> Tuple[str, list]:
+    """Search the web using Exa API, giving up at the optional time.monotonic() deadline."""
+    try:
+        logger.info(f"Searching web with Exa API. Query: {query}, Results: {num_results}")
+        with metrics.stage("search"):
+            search_results = await asyncio.wait_for(search_exa(query, num_results), resilience.time_left(deadline))
         logger.info(f"Searching web with Exa API. Query: {query}, Results: {search_results}")
         # Store raw results for UI display - fix the attribute access
         if hasattr(st, 'session_state'):
@@ -153,6 +384,9 @@ async def search_web(query: str, num_results: int = 5) -> Tuple[str, list]:
         formatted_results = format_search_results(search_results)
         logger.info(f"Found {len(search_results.results)} search results")
         return formatted_results, search_results.results
+    except asyncio.TimeoutError:
+        logger.error(f"Web search for '{query}' did not finish before the request deadline")
+        return "Search did not finish before the request deadline", []
     except Exception as e:
         logger.error(f"Error in web search: {str(e)}")
         return f"An error occurred while searching with Exa: {e}", []
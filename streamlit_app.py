@@ -35,6 +35,29 @@ def init_session_state():
     if 'search_history' not in st.session_state:
         st.session_state.search_history = []
 
+# Partial results streamed by the MCP server for the current query
+streamed_results = {"search_results": None, "rag_results": [], "status": ""}
+
+async def render_partial_result(update):
+    """Render a partial result as soon as the MCP server sends it"""
+    event = update.get("event")
+    if event == "search_results":
+        streamed_results["search_results"] = update.get("search_results")
+    elif event == "rag_result":
+        streamed_results["rag_results"].append(update.get("result", {}))
+    elif event == "progress" and update.get("message"):
+        streamed_results["status"] = update["message"]
+    
+    preview = ""
+    if streamed_results["status"]:
+        preview += f"*⏳ {streamed_results['status']}*\n\n"
+    for item in streamed_results["rag_results"]:
+        source = item.get("metadata", {}).get("source", "")
+        preview += f"> {item.get('content', '')[:300]}...\n>\n> *[Source]({source})*\n\n"
+    if streamed_results["search_results"]:
+        preview += streamed_results["search_results"]
+    stream_placeholder.markdown(preview)
+
 async def process_query(query: str):
     """Process the search query"""
     try:
@@ -44,7 +67,8 @@ async def process_query(query: str):
                     await st.session_state.agent.initialize_agent()
                 
             with st.spinner("🔍 Analyzing and processing results..."):
-                response = await st.session_state.agent.process_message(query)
+                response = await st.session_state.agent.process_message(query, on_update=render_partial_result)
+                stream_placeholder.empty()
                 print(f"Response from MCP server: {response}")
                 print(f"Type of response: {type(response)}")
                 
@@ -458,6 +482,9 @@ query = st.text_input(
 # Create placeholder for status messages
 status_placeholder = st.empty()
 
+# Placeholder for partial results while the analysis is still running
+stream_placeholder = st.empty()
+
 # Process query when entered
 if query:
     # Add to search history
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+# Offline settings, read by the modules at import time
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+os.environ.setdefault("PROCESS_POOL_SIZE", "0")
+
+import pytest
+from langchain_core.documents import Document
+
+import cache
+import embeddings
+import mcp_server
+import rag
+import search
+
+TOPICS = ["harbour", "glacier", "orchard", "volcano", "library", "railway"]
+
+def page_text(topic: str, variant: str = "") -> str:
+    paragraphs = [
+        f"Paragraph {i} about the {topic}: " + " ".join(f"{topic}{j} fact{(i * 7 + j) % 50}" for j in range(60))
+        for i in range(6)
+    ]
+    return "\n\n".join(paragraphs) + variant
+
+PAGES = {
+    "https://a.example/harbour": page_text("harbour"),
+    # The harbour page syndicated on another site, with a paragraph of its own
+    "https://b.example/harbour": page_text("harbour", "\n\nSyndicated copy: " + " ".join(f"reprint{j}" for j in range(60))),
+    "https://c.example/glacier": page_text("glacier"),
+    "https://d.example/orchard": page_text("orchard"),
+    "https://e.example/volcano": page_text("volcano"),
+}
+
+RESULTS = {
+    "harbour history": ["https://a.example/harbour", "https://d.example/orchard"],
+    "harbour fact12": ["https://b.example/harbour", "https://c.example/glacier"],
+    "glacier and volcano": ["https://c.example/glacier", "https://e.example/volcano", "https://d.example/orchard"],
+}
+
+@pytest.fixture
+def offline(monkeypatch):
+    async def search_web(query, num_results=5, deadline=None):
+        urls = RESULTS[query][:num_results]
+        return f"Results for {query}", [SimpleNamespace(url=url) for url in urls]
+
+    async def fetch_page(url, hedge_after=None):
+        return [Document(page_content=PAGES[url], metadata={"source": url})]
+
+    def fresh_corpus():
+        rag._corpus = rag.VectorCorpus(embeddings=embeddings.HashingEmbeddings())
+
+    monkeypatch.setattr(search, "search_web", search_web)
+    monkeypatch.setattr(search, "fetch_page", fetch_page)
+    monkeypatch.setattr(cache, "get_query_cache", lambda: None)
+    monkeypatch.setattr(rag, "_corpus", None)
+    return fresh_corpus
+
+@pytest.mark.parametrize("mode", ["dense", "lexical", "hybrid"])
+def test_batch_matches_single_queries(offline, mode):
+    single = {}
+    for query in RESULTS:
+        offline()
+        single[query] = asyncio.run(mcp_server.run_search_and_analyze(query, 5, 3, False, None, mode=mode))
+        assert "error" not in single[query]
+
+    offline()
+    batch = asyncio.run(mcp_server.run_batch_search_and_analyze(list(RESULTS), 5, 3, False, None, mode=mode))
+
+    assert batch["stats"]["unique_pages"] == len(PAGES)
+    for result in batch["results"]:
+        query = result.pop("query")
+        assert result == single[query]
+
+def test_batch_answers_repeated_queries_once(offline):
+    offline()
+    batch = asyncio.run(mcp_server.run_batch_search_and_analyze(
+        ["harbour history", " harbour history ", "glacier and volcano"], 5, 3, False, None
+    ))
+
+    assert [result["query"] for result in batch["results"]] == ["harbour history", " harbour history ", "glacier and volcano"]
+    assert batch["results"][0]["rag_analysis"] == batch["results"][1]["rag_analysis"]
+    assert batch["stats"]["unique_queries"] == 2
+
+def test_near_duplicate_pages_share_chunks(offline):
+    offline()
+    corpus = rag._corpus
+    original = Document(page_content=page_text("harbour"), metadata={"source": "https://a.example/harbour"})
+    copy = Document(page_content=page_text("harbour", " Syndicated copy."), metadata={"source": "https://b.example/harbour"})
+    for document in (original, copy):
+        asyncio.run(corpus.add_documents(asyncio.run(rag.prepare_chunks([document]))))
+
+    # The copy's chunks are aliases of the original's, not embedded again
+    assert len(corpus) == len(asyncio.run(rag.prepare_chunks([original])))
+    for mode in ["dense", "lexical", "hybrid"]:
+        found = asyncio.run(corpus.search("harbour fact12", k=3, sources=["https://b.example/harbour"], mode=mode))
+        assert found and {document.metadata["source"] for document in found} == {"https://b.example/harbour"}
+
+    # Replacing the original leaves the copy to be fetched again
+    asyncio.run(corpus.replace_source("https://a.example/harbour", [Document(page_content="Moved.", metadata={})]))
+    assert not corpus.has_fresh_source("https://b.example/harbour")
+
+def test_batch_through_remote_corpus(offline, monkeypatch):
+    offline()
+    expected = asyncio.run(mcp_server.run_batch_search_and_analyze(list(RESULTS), 5, 3, False, None, mode="hybrid"))
+
+    # A worker's calls reach the writer's corpus as JSON
+    offline()
+    writer = rag._corpus
+    async def call(self, operation, **payload):
+        result = await rag.serve_corpus_call(writer, operation, json.loads(json.dumps(payload)))
+        return json.loads(json.dumps(result))
+    monkeypatch.setattr(rag.RemoteCorpus, "_call", call)
+    rag._corpus = rag.RemoteCorpus("http://writer.invalid")
+
+    assert asyncio.run(mcp_server.run_batch_search_and_analyze(list(RESULTS), 5, 3, False, None, mode="hybrid")) == expected
+    assert len(writer) > 0
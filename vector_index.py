@@ -0,0 +1,147 @@
+from functools import lru_cache
+from typing import Optional, Sequence
+import logging
+import os
+import time
+import faiss
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+# Preset name or a raw faiss.index_factory string (e.g. "IVF4096,PQ32")
+FAISS_INDEX = os.getenv("FAISS_INDEX", "flat")
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "1024"))  # IVF lists
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))  # IVF lists scanned per query
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))  # HNSW graph neighbours per node
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))  # HNSW candidates explored per query
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))  # PQ sub-quantizers, one byte each
+# Vectors kept in a flat index before a trained index is built (about 39 per IVF list)
+FAISS_TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", "40000"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))  # max vectors used for training
+# Rebuild indexes without removal support once this share of their vectors is deleted
+FAISS_COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", "0.2"))
+# Filtered HNSW searches over at most this many vectors score them all exactly
+EXACT_SUBSET_MAX = 20000
+
+# Bytes per 1024-dim vector: flat 4096, fp16 2048, sq8 1024, ivfpq 64 (+ graph or list ids)
+BACKENDS = {
+    "flat": "Flat",
+    "fp16": "SQfp16",
+    "sq8": "SQ8",
+    "ivf": "IVF{nlist},Flat",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "ivfpq": "IVF{nlist},PQ{pq_m}",
+    "hnsw": "HNSW{hnsw_m}",
+    "hnsw_fp16": "HNSW{hnsw_m}_SQfp16",
+    "hnsw_sq8": "HNSW{hnsw_m}_SQ8",
+}
+
+def factory_string(spec: str, dim: int) -> str:
+    """Resolve a backend preset (or pass through a factory string) for a dimension."""
+    pq_m = max(m for m in range(1, min(FAISS_PQ_M, dim) + 1) if dim % m == 0)
+    return BACKENDS.get(spec.lower(), spec).format(nlist=FAISS_NLIST, hnsw_m=FAISS_HNSW_M, pq_m=pq_m)
+
+@lru_cache(maxsize=None)
+def needs_training(spec: str, dim: int) -> bool:
+    return not faiss.index_factory(dim, factory_string(spec, dim)).is_trained
+
+def is_staging(index: faiss.Index, spec: str) -> bool:
+    """True for the flat index that holds vectors until the configured index can be trained."""
+    return isinstance(index, faiss.IndexFlat) and needs_training(spec, index.d)
+
+def supports_removal(index: faiss.Index) -> bool:
+    """Whether remove_ids keeps positions contiguous, as LangChain's FAISS.delete expects."""
+    return isinstance(index, faiss.IndexFlatCodes)
+
+def tune(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> faiss.Index:
+    """Apply the search-time parameters (nprobe, efSearch) the index supports."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe or FAISS_NPROBE
+    except RuntimeError:
+        pass
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search or FAISS_EF_SEARCH
+    return index
+
+def build(vectors: np.ndarray, spec: str = FAISS_INDEX) -> faiss.Index:
+    """
+    Build an index for the configured backend holding vectors.
+
+    Backends that need training get a flat index while fewer than
+    FAISS_TRAIN_SIZE vectors exist; otherwise they are trained on a random
+    sample of at most FAISS_TRAIN_SAMPLE vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+    if needs_training(spec, dim) and len(vectors) < FAISS_TRAIN_SIZE:
+        index = faiss.IndexFlatL2(dim)
+        index.add(vectors)
+        return index
+    index = faiss.index_factory(dim, factory_string(spec, dim))
+    if not index.is_trained:
+        start = time.perf_counter()
+        sample = vectors
+        if len(vectors) > FAISS_TRAIN_SAMPLE:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), FAISS_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+        logger.info(f"Trained {factory_string(spec, dim)} on {len(sample)} vectors in {time.perf_counter() - start:.1f}s")
+    index.add(vectors)
+    return tune(index)
+
+def search_subset(index: faiss.Index, queries: np.ndarray, positions: Sequence[int], k: int):
+    """
+    Search only the vectors at the given positions (e.g. the chunks of a few sources).
+
+    Flat, scalar-quantized and IVF indexes skip the other vectors with an ID
+    selector; IVF scans every list, as the selector rather than nprobe bounds
+    the work. A graph search (HNSW) finds little of a small subset, so such
+    subsets are scored exactly on their decoded vectors instead.
+    Returns (distances, positions) like faiss.Index.search.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    positions = np.ascontiguousarray(positions, dtype=np.int64)
+    k = min(k, len(positions))
+    if isinstance(index, faiss.IndexHNSW) and len(positions) <= EXACT_SUBSET_MAX:
+        distances, found = faiss.knn(queries, index.reconstruct_batch(positions), k)
+        return distances, np.where(found >= 0, positions[np.maximum(found, 0)], -1)
+    selector = faiss.IDSelectorBatch(positions)
+    try:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nlist)
+    except RuntimeError:
+        if isinstance(index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+        else:
+            params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+def clone(index: faiss.Index) -> faiss.Index:
+    """A copy of the index with its training, vectors and search settings"""
+    return faiss.clone_index(index)
+
+def serialize(index: faiss.Index) -> np.ndarray:
+    """The index as the bytes faiss.write_index would write."""
+    return faiss.serialize_index(index)
+
+def empty_like(index: faiss.Index) -> faiss.Index:
+    """An empty copy of a trained index, keeping its training and search parameters."""
+    fresh = faiss.clone_index(index)
+    fresh.reset()
+    return tune(fresh)
+
+def reconstruct(index: faiss.Index, positions: Sequence[int]) -> np.ndarray:
+    """Stored vectors at the given positions (decoded, so approximate for quantized indexes)."""
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return index.reconstruct_batch(positions)
+    # IVF lookups by position need a direct map, dropped again to save memory
+    ivf.make_direct_map(True)
+    try:
+        return index.reconstruct_batch(positions)
+    finally:
+        ivf.make_direct_map(False)
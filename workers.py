@@ -0,0 +1,331 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set
+from aiohttp import web
+import aiohttp
+import asyncio
+import logging
+import os
+import re
+import signal
+import sys
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+# Public address of the proxy, as for a single mcp_server.py
+MCP_SERVER_HOST = os.getenv("MCP_SERVER_HOST", "localhost")
+MCP_SERVER_PORT = int(os.getenv("MCP_SERVER_PORT", "8000"))
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", str(os.cpu_count() or 1)))
+MCP_WORKER_BASE_PORT = int(os.getenv("MCP_WORKER_BASE_PORT", str(MCP_SERVER_PORT + 1)))  # worker i listens on base + i
+WORKER_HOST = "127.0.0.1"
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "120"))  # seconds
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))  # seconds
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_server.py")
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host", "content-length"
+}
+# The first SSE event names the endpoint the client posts its messages to
+SESSION_ID = re.compile(rb"session_id=([0-9a-fA-F]+)")
+SESSION_ID_SEARCH_BYTES = 4096
+METRIC_SAMPLE = re.compile(r"^([A-Za-z_:][A-Za-z0-9_:]*)(?:\{(.*)\})? (.*)$")
+
+def worker_env(index: int, workers: int = MCP_WORKERS) -> Dict[str, str]:
+    """
+    Environment of one worker process.
+
+    Each worker listens on its own port. Worker 0 owns the corpus and
+    serves it to the others (rag.RemoteCorpus), so it is held once; the
+    page cache (SQLite) and embedding cache (memory-mapped vectors) under
+    CACHE_DIR are shared. Process-wide budgets are split across the
+    workers unless set explicitly.
+    """
+    cpus = os.cpu_count() or 1
+    env = dict(os.environ)
+    env.update({
+        "MCP_SERVER_HOST": WORKER_HOST,
+        "MCP_SERVER_PORT": str(MCP_WORKER_BASE_PORT + index),
+    })
+    if index == 0:
+        env["CORPUS_WRITER"] = "1"
+        env.pop("CORPUS_WRITER_URL", None)
+    else:
+        env["CORPUS_WRITER"] = "0"
+        env["CORPUS_WRITER_URL"] = f"http://{WORKER_HOST}:{MCP_WORKER_BASE_PORT}"
+    env.setdefault("PROCESS_POOL_SIZE", str(max(1, cpus // workers)))
+    env.setdefault("CPU_POOL_SIZE", str(max(2, cpus // workers)))
+    # Vectors beyond the in-memory tier are read from the shared memory map
+    env.setdefault("EMBEDDING_CACHE_MEMORY_ITEMS", str(max(1000, 20000 // workers)))
+    return env
+
+class SessionRouter:
+    """
+    Assigns SSE streams to workers and remembers which worker owns each MCP session.
+
+    A session's messages must reach the process holding its stream, so
+    posts are routed by session_id; new streams go to the worker with the
+    fewest open ones.
+    """
+
+    def __init__(self, ports: Sequence[int]):
+        self.ports = list(ports)
+        self.streams = [0] * len(self.ports)
+        self.sessions: Dict[str, int] = {}
+        self._next = 0
+
+    def assign(self, exclude: Optional[Set[int]] = None) -> Optional[int]:
+        """Pick a worker for a new stream (fewest open streams, rotating among ties)"""
+        candidates = [
+            (self._next + offset) % len(self.ports)
+            for offset in range(len(self.ports))
+            if (self._next + offset) % len(self.ports) not in (exclude or set())
+        ]
+        if not candidates:
+            return None
+        worker = min(candidates, key=lambda index: self.streams[index])
+        self._next = (worker + 1) % len(self.ports)
+        self.streams[worker] += 1
+        return worker
+
+    def bind(self, session_id: str, worker: int) -> None:
+        self.sessions[session_id] = worker
+
+    def lookup(self, session_id: str) -> Optional[int]:
+        return self.sessions.get(session_id)
+
+    def release(self, worker: int, session_id: Optional[str] = None) -> None:
+        self.streams[worker] -= 1
+        if session_id:
+            self.sessions.pop(session_id, None)
+
+    def forget_worker(self, worker: int) -> None:
+        """Drop the sessions of a worker that exited; their clients have to reconnect"""
+        for session_id in [session_id for session_id, owner in self.sessions.items() if owner == worker]:
+            del self.sessions[session_id]
+
+def merge_metrics(texts: Sequence[Optional[str]]) -> str:
+    """Combine the /metrics output of the workers, labelling every sample with its worker"""
+    families: "OrderedDict[str, Dict[str, List[str]]]" = OrderedDict()
+    for worker, text in enumerate(texts):
+        if text is None:
+            continue
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = families.setdefault(line.split(" ")[2], {"headers": [], "samples": []})
+                if line not in family["headers"]:
+                    family["headers"].append(line)
+                continue
+            match = METRIC_SAMPLE.match(line)
+            if match is None or family is None:
+                continue
+            name, labels, value = match.groups()
+            labels = f'worker="{worker}",{labels}' if labels else f'worker="{worker}"'
+            family["samples"].append(f"{name}{{{labels}}} {value}")
+    return "\n".join(line for family in families.values() for line in family["headers"] + family["samples"]) + "\n"
+
+def _forward_headers(headers) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+
+class WorkerProxy:
+    """HTTP front end on the public port: SSE streams and their messages go to one worker"""
+
+    def __init__(self, router: SessionRouter):
+        self.router = router
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._next = 0
+
+    def _url(self, worker: int, request: web.Request) -> str:
+        return f"http://{WORKER_HOST}:{self.router.ports[worker]}{request.rel_url}"
+
+    async def _start(self, app: web.Application) -> None:
+        # SSE streams stay open indefinitely: no total or read timeout, no connection cap
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+            auto_decompress=False
+        )
+
+    async def _stop(self, app: web.Application) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle_sse(self, request: web.Request) -> web.StreamResponse:
+        tried: Set[int] = set()
+        while True:
+            worker = self.router.assign(exclude=tried)
+            if worker is None:
+                return web.Response(status=503, text="No MCP worker available")
+            try:
+                upstream = await self._session.get(self._url(worker, request), headers=_forward_headers(request.headers))
+                break
+            except aiohttp.ClientConnectionError as e:
+                logger.warning(f"Worker {worker} unavailable for a new stream: {str(e)}")
+                self.router.release(worker)
+                tried.add(worker)
+        session_id = None
+        buffered = b""
+        response = None
+        try:
+            async with upstream:
+                response = web.StreamResponse(status=upstream.status, headers=_forward_headers(upstream.headers))
+                await response.prepare(request)
+                async for chunk in upstream.content.iter_any():
+                    if session_id is None and len(buffered) < SESSION_ID_SEARCH_BYTES:
+                        buffered += chunk
+                        match = SESSION_ID.search(buffered)
+                        if match:
+                            session_id = match.group(1).decode("ascii")
+                            self.router.bind(session_id, worker)
+                            logger.info(f"Session {session_id} pinned to worker {worker}")
+                    await response.write(chunk)
+                return response
+        except (ConnectionResetError, aiohttp.ClientError) as e:
+            # Client went away or the worker died; either way the stream is over
+            logger.info(f"Stream of session {session_id} on worker {worker} closed: {str(e)}")
+            return response if response is not None else web.Response(status=502, text="MCP worker unavailable")
+        finally:
+            self.router.release(worker, session_id)
+
+    async def _forward(self, worker: int, request: web.Request) -> web.Response:
+        try:
+            async with self._session.request(
+                request.method,
+                self._url(worker, request),
+                headers=_forward_headers(request.headers),
+                data=await request.read()
+            ) as upstream:
+                return web.Response(
+                    status=upstream.status,
+                    body=await upstream.read(),
+                    headers=_forward_headers(upstream.headers)
+                )
+        except aiohttp.ClientError as e:
+            logger.error(f"Forwarding {request.method} {request.path} to worker {worker} failed: {str(e)}")
+            return web.Response(status=502, text="MCP worker unavailable")
+
+    async def handle_message(self, request: web.Request) -> web.Response:
+        session_id = request.query.get("session_id")
+        if not session_id:
+            return web.Response(status=400, text="session_id is required")
+        worker = self.router.lookup(session_id)
+        if worker is None:
+            return web.Response(status=404, text="Could not find session")
+        return await self._forward(worker, request)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        async def scrape(port: int) -> Optional[str]:
+            try:
+                async with self._session.get(f"http://{WORKER_HOST}:{port}/metrics") as upstream:
+                    return await upstream.text()
+            except aiohttp.ClientError as e:
+                logger.warning(f"Could not scrape worker on port {port}: {str(e)}")
+                return None
+
+        texts = await asyncio.gather(*(scrape(port) for port in self.router.ports))
+        return web.Response(text=merge_metrics(texts), content_type="text/plain", charset="utf-8")
+
+    async def handle_internal(self, request: web.Request) -> web.Response:
+        # The corpus routes are for the workers only, not for clients of the public port
+        return web.Response(status=404, text="Not found")
+
+    async def handle_other(self, request: web.Request) -> web.Response:
+        if "session_id" in request.query:
+            return await self.handle_message(request)
+        worker = self._next % len(self.router.ports)
+        self._next += 1
+        return await self._forward(worker, request)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        app.router.add_get("/sse", self.handle_sse)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_route("*", "/corpus/{tail:.*}", self.handle_internal)
+        app.router.add_route("*", "/{tail:.*}", self.handle_other)
+        return app
+
+class WorkerSupervisor:
+    """Runs the mcp_server.py worker processes and restarts any that exit"""
+
+    def __init__(self, router: SessionRouter):
+        self.router = router
+        self.processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run_worker(index)) for index in range(len(self.router.ports))]
+
+    async def _run_worker(self, index: int) -> None:
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, WORKER_SCRIPT, env=worker_env(index, len(self.router.ports))
+            )
+            self.processes[index] = process
+            logger.info(f"Started worker {index} (pid {process.pid}) on port {self.router.ports[index]}")
+            code = await process.wait()
+            if self._stopping:
+                return
+            logger.warning(f"Worker {index} exited with code {code}, restarting in {WORKER_RESTART_DELAY}s")
+            self.router.forget_worker(index)
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def wait_ready(self, timeout: float = WORKER_START_TIMEOUT) -> None:
+        """Wait until every worker accepts connections (or the timeout passes)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for port in self.router.ports:
+            while loop.time() < deadline:
+                try:
+                    _, writer = await asyncio.open_connection(WORKER_HOST, port)
+                    writer.close()
+                    break
+                except OSError:
+                    await asyncio.sleep(0.2)
+            else:
+                logger.warning(f"Worker on port {port} not ready after {timeout}s, serving without it for now")
+                return
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+        for task in self._tasks:
+            task.cancel()
+
+async def serve(workers: int = MCP_WORKERS) -> None:
+    """Start the workers, then proxy the public port to them until interrupted"""
+    router = SessionRouter([MCP_WORKER_BASE_PORT + index for index in range(workers)])
+    supervisor = WorkerSupervisor(router)
+    supervisor.start()
+    await supervisor.wait_ready()
+    runner = web.AppRunner(WorkerProxy(router).app())
+    await runner.setup()
+    await web.TCPSite(runner, MCP_SERVER_HOST, MCP_SERVER_PORT).start()
+    logger.info(f"Proxying http://{MCP_SERVER_HOST}:{MCP_SERVER_PORT} to {workers} workers")
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        await runner.cleanup()
+        await supervisor.stop()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Starting {MCP_WORKERS} MCP server workers...")
+    print(f"Server will be available at http://{MCP_SERVER_HOST}:{MCP_SERVER_PORT}")
+    asyncio.run(serve())